@@ -0,0 +1,398 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Web API client on asyncio and aiohttp, used by ``--engine async``.
+
+One event loop thread keeps as many requests in flight as the semaphore
+allows, instead of one blocked thread per request. The client implements the
+endpoints spotify-playlists.py uses, with the names and arguments of the
+spotipy.Spotify methods, and the same rate budget and retry policy as
+scheduler.ScheduledSpotify.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import random
+import time
+
+import aiohttp
+import spotipy
+
+import stats
+
+logger = logging.getLogger(__name__)
+
+# writes of the endpoints below that are repeated after a 5xx, like
+# scheduler.IDEMPOTENT_WRITE_METHODS; GET requests are always retried
+IDEMPOTENT_WRITES = frozenset(
+    (
+        "DELETE me/library",
+        "DELETE playlists/{id}/followers",
+        "PUT me/library",
+        "PUT playlists/{id}",
+    )
+)
+
+
+class AsyncTokenBucket:
+    """Request budget for one event loop, like scheduler.TokenBucket.
+
+    Callers are served in arrival order (asyncio.Lock is fair); unlike the
+    threaded bucket, writes are not scheduled ahead of reads.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                elif self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                else:
+                    self._tokens -= 1
+                    return
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+async def iter_pages(fetch, limit=50, window=16, first=None, reverse=False):
+    """Async version of iter_pages() in spotify-playlists.py.
+
+    After the first page, up to ``window`` of the remaining pages are
+    requested at the same time and yielded in order, or from the last one to
+    the first with ``reverse``.
+    """
+    page = first if first is not None else await fetch(limit=limit, offset=0)
+    if not reverse:
+        yield page
+
+    offsets = range(limit, page["total"], limit)
+    if reverse:
+        offsets = offsets[::-1]
+    pending = collections.deque()
+    try:
+        for offset in offsets:
+            pending.append(asyncio.ensure_future(fetch(limit=limit, offset=offset)))
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+        if reverse:
+            yield page
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _uri(kind, item):
+    return item if item.startswith("spotify:") else f"spotify:{kind}:{item}"
+
+
+def _id(item):
+    return item.rsplit(":", 1)[-1]
+
+
+class AsyncSpotifyClient:
+    """The Web API endpoints used by spotify-playlists.py, as coroutines.
+
+    Authentication is either a fixed access token (``auth``) or an
+    ``auth_manager``, a scheduler.SharedSpotifyOAuth whose token is refreshed
+    on a worker thread. At most ``concurrency`` requests are in flight. Every
+    request takes a token from ``bucket`` (an AsyncTokenBucket). A 429
+    response pauses the bucket for Retry-After, and 5xx responses of GET
+    requests and IDEMPOTENT_WRITES are retried with jittered exponential
+    backoff. Errors are raised as
+    spotipy.SpotifyException, like the threaded engine does. ``timeouts``
+    are (connect, read) pairs for "read" and "write" requests, as in
+    constants.TIMEOUTS. Responses and waits are reported to ``stats`` (a
+    stats.ApiStats) if given.
+
+    Use it as an async context manager, which opens and closes the
+    connection pool.
+    """
+
+    prefix = "https://api.spotify.com/v1/"
+
+    def __init__(
+        self,
+        auth=None,
+        auth_manager=None,
+        bucket=None,
+        concurrency=32,
+        timeouts=None,
+        stats=None,
+        max_retries=8,
+        backoff=0.5,
+        max_backoff=30,
+    ):
+        self._auth = auth
+        self._auth_manager = auth_manager
+        self._token_info = None
+        self._token_lock = asyncio.Lock()
+        self._bucket = bucket
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._concurrency = concurrency
+        self._timeouts = {
+            kind: aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+            for kind, (connect, read) in (timeouts or {}).items()
+        }
+        self._stats = stats
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._concurrency),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def _token(self):
+        if self._auth is not None:
+            return self._auth
+        token_info = self._token_info
+        if token_info is None or self._auth_manager.is_token_expired(token_info):
+            async with self._token_lock:
+                token_info = self._token_info
+                if token_info is None or self._auth_manager.is_token_expired(
+                    token_info
+                ):
+                    # may refresh the token or read the cache file
+                    token_info = self._token_info = await asyncio.to_thread(
+                        self._auth_manager.get_access_token, as_dict=True
+                    )
+        return token_info["access_token"]
+
+    async def _request(self, method, path, params=None, payload=None):
+        url = path if path.startswith("http") else self.prefix + path
+        params = {
+            key: str(value).lower() if isinstance(value, bool) else str(value)
+            for key, value in (params or {}).items()
+            if value is not None
+        }
+        data = json.dumps(payload) if payload is not None else None
+        timeout = self._timeouts.get("read" if method == "GET" else "write")
+
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                if self._bucket is not None:
+                    start = time.monotonic()
+                    await self._bucket.acquire()
+                    if self._stats is not None:
+                        self._stats.record_wait("rate budget", time.monotonic() - start)
+                headers = {
+                    "Authorization": f"Bearer {await self._token()}",
+                    "Content-Type": "application/json",
+                }
+                start = time.perf_counter()
+                async with self._session.request(
+                    method,
+                    url,
+                    params=params,
+                    data=data,
+                    headers=headers,
+                    timeout=timeout,
+                ) as response:
+                    body = await response.read()
+                latency = time.perf_counter() - start
+            if self._stats is not None:
+                self._stats.record_response(
+                    method, str(response.url), response.status, latency, len(body)
+                )
+
+            if response.status < 400:
+                return json.loads(body) if body else None
+
+            error = self._error(response, body, url)
+            if attempt >= self._max_retries:
+                raise error
+            if response.status == 429:
+                delay = self._retry_after(response)
+                logger.warning("rate limited, pausing requests for %.1f s", delay)
+                if self._bucket is not None:
+                    self._bucket.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
+            elif response.status >= 500:
+                endpoint = stats.endpoint_name(method, url)
+                if method != "GET" and endpoint not in IDEMPOTENT_WRITES:
+                    logger.error(
+                        "server error %d in %s, not retried since it may "
+                        "have been applied; run the command again to finish",
+                        response.status,
+                        endpoint,
+                    )
+                    raise error
+                delay = random.uniform(
+                    0, min(self._max_backoff, self._backoff * 2**attempt)
+                )
+                logger.warning(
+                    "server error %d, retrying in %.1f s", response.status, delay
+                )
+                if self._stats is not None:
+                    self._stats.record_wait("backoff", delay)
+                await asyncio.sleep(delay)
+            else:
+                raise error
+            if self._stats is not None:
+                self._stats.record_retry()
+            attempt += 1
+
+    @staticmethod
+    def _error(response, body, url):
+        try:
+            message = json.loads(body)["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = "error"
+        return spotipy.SpotifyException(
+            response.status,
+            -1,
+            f"{url}:\n {message}",
+            headers=dict(response.headers),
+        )
+
+    def _retry_after(self, response):
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            return min(self._max_backoff, self._backoff * 2)
+
+    async def me(self):
+        return await self._request("GET", "me/")
+
+    async def user_playlists(self, user, limit=50, offset=0):
+        return await self._request(
+            "GET", f"users/{user}/playlists", {"limit": limit, "offset": offset}
+        )
+
+    async def playlist_items(
+        self,
+        playlist_id,
+        fields=None,
+        limit=100,
+        offset=0,
+        additional_types=("track", "episode"),
+    ):
+        return await self._request(
+            "GET",
+            f"playlists/{_id(playlist_id)}/items",
+            {
+                "limit": limit,
+                "offset": offset,
+                "fields": fields,
+                "additional_types": ",".join(additional_types),
+            },
+        )
+
+    async def current_user_saved_tracks(self, limit=20, offset=0):
+        return await self._request(
+            "GET", "me/tracks", {"limit": limit, "offset": offset}
+        )
+
+    async def current_user_saved_albums(self, limit=20, offset=0):
+        return await self._request(
+            "GET", "me/albums", {"limit": limit, "offset": offset}
+        )
+
+    async def current_user_saved_shows(self, limit=20, offset=0):
+        return await self._request(
+            "GET", "me/shows", {"limit": limit, "offset": offset}
+        )
+
+    async def _library(self, method, kind, items):
+        uris = ",".join(_uri(kind, item) for item in items)
+        return await self._request(method, "me/library", {"uris": uris})
+
+    async def current_user_saved_tracks_add(self, tracks):
+        return await self._library("PUT", "track", tracks)
+
+    async def current_user_saved_tracks_delete(self, tracks):
+        return await self._library("DELETE", "track", tracks)
+
+    async def current_user_saved_albums_add(self, albums):
+        return await self._library("PUT", "album", albums)
+
+    async def current_user_saved_albums_delete(self, albums):
+        return await self._library("DELETE", "album", albums)
+
+    async def current_user_saved_shows_add(self, shows):
+        return await self._library("PUT", "show", shows)
+
+    async def current_user_saved_shows_delete(self, shows):
+        return await self._library("DELETE", "show", shows)
+
+    async def user_playlist_create(
+        self, user, name, public=True, collaborative=False, description=""
+    ):
+        return await self._request(
+            "POST",
+            f"users/{user}/playlists",
+            payload={
+                "name": name,
+                "public": public,
+                "collaborative": collaborative,
+                "description": description,
+            },
+        )
+
+    async def playlist_add_items(self, playlist_id, items, position=None):
+        return await self._request(
+            "POST",
+            f"playlists/{_id(playlist_id)}/items",
+            {"position": position},
+            payload=[_uri("track", item) for item in items],
+        )
+
+    async def playlist_change_details(
+        self, playlist_id, name=None, public=None, collaborative=None, description=None
+    ):
+        payload = {
+            key: value
+            for key, value in (
+                ("name", name),
+                ("public", public),
+                ("collaborative", collaborative),
+                ("description", description),
+            )
+            if value is not None
+        }
+        return await self._request(
+            "PUT", f"playlists/{_id(playlist_id)}", payload=payload
+        )
+
+    async def current_user_unfollow_playlist(self, playlist_id):
+        return await self._request("DELETE", f"playlists/{_id(playlist_id)}/followers")
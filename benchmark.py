@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Offline benchmarks of spotify-playlists.py against fake_spotify.py.
+
+Every scenario gets a fresh in-memory library served by a local fake Web API
+in this process, while the measured code runs in a spawned child process so
+its peak RSS can be reported on its own.
+"""
+
+import argparse
+import asyncio
+import builtins
+import functools
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import fake_spotify
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "spotify-playlists.py"
+)
+TRACKS_PER_PLAYLIST = 500
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("spotify_playlists", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    # registered so that process pools can pickle the script's functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    # the script configures INFO logging on import, spotipy logs every 429
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL)
+    return module
+
+
+def make_client(spl, prefix, rate, jobs=1):
+    session = spl.scheduler.build_session(
+        pool_size=spl.scheduler.default_pool_size(jobs)
+    )
+    raw = spl.spotipy.Spotify(auth="benchmark", requests_session=session)
+    raw.prefix = prefix
+    return spl.scheduler.ScheduledSpotify(raw, spl.scheduler.TokenBucket(rate))
+
+
+def make_async_client(spl, prefix, rate, jobs=1):
+    client = spl.async_client.AsyncSpotifyClient(
+        auth="benchmark",
+        bucket=spl.async_client.AsyncTokenBucket(rate),
+        concurrency=jobs,
+    )
+    client.prefix = prefix
+    return client
+
+
+# --- scenarios --------------------------------------------------------------
+#
+# library(size) returns the arguments for fake_spotify.Library, setup(spl,
+# workdir, size) prepares files outside of the measurement and run(spl, sp,
+# workdir, jobs) is what gets timed. run_async(spl, client, workdir, jobs) is
+# the coroutine timed for --engine async.
+
+
+def _write_tracks(spl, workdir, name, size, pl_type):
+    tracks = (
+        spl.records.make_track(
+            f"Track {n}", f"Artist {n % 997}", fake_spotify.Library.track_uri(n)
+        )
+        for n in range(size)
+    )
+    spl.write_playlist(name, workdir, tracks, pl_type=pl_type)
+
+
+def _setup_playlists(spl, workdir, size):
+    for n in range(max(1, size // TRACKS_PER_PLAYLIST)):
+        _write_tracks(
+            spl, workdir, f"Imported {n}", min(size, TRACKS_PER_PLAYLIST), "playlist"
+        )
+
+
+def _setup_saved_tracks(spl, workdir, size):
+    _write_tracks(spl, workdir, "Saved tracks", size, "saved_tracks")
+
+
+def _delete_all(spl, sp, workdir, jobs):
+    builtins.input = lambda prompt="": "yes"
+    spl.delete_all_user_playlists(sp, jobs=jobs)
+    spl.delete_all_saved_tracks(sp, jobs=jobs)
+    spl.delete_all_saved_albums(sp, jobs=jobs)
+    spl.delete_all_saved_shows(sp, jobs=jobs)
+
+
+def _export_albums_async(spl, client, workdir, jobs):
+    return spl._export_saved_async(
+        client,
+        "albums",
+        spl.process_albums,
+        functools.partial(spl.write_albums, workdir),
+        jobs,
+    )
+
+
+def _empty_library(size):
+    return dict(playlists=0, saved_tracks=0, saved_albums=0, saved_shows=0)
+
+
+SCENARIOS = {
+    "export_playlists": (
+        lambda size: dict(
+            playlists=max(1, size // TRACKS_PER_PLAYLIST),
+            tracks_per_playlist=min(size, TRACKS_PER_PLAYLIST),
+            saved_tracks=0,
+            saved_albums=0,
+            saved_shows=0,
+        ),
+        None,
+        lambda spl, sp, workdir, jobs: spl.export_playlists(
+            sp, "bench", workdir, jobs=jobs, full=True
+        ),
+        lambda spl, client, workdir, jobs: spl.export_library_async(
+            client, "bench", workdir, jobs=jobs
+        ),
+    ),
+    "import_playlist": (
+        _empty_library,
+        _setup_playlists,
+        lambda spl, sp, workdir, jobs: spl.import_playlist(
+            sp, "bench", workdir, jobs=jobs
+        ),
+        lambda spl, client, workdir, jobs: spl.import_playlists_async(
+            client, "bench", workdir, jobs=jobs
+        ),
+    ),
+    "export_albums": (
+        lambda size: dict(
+            playlists=0, saved_tracks=0, saved_albums=size, saved_shows=0
+        ),
+        None,
+        lambda spl, sp, workdir, jobs: spl.export_albums(
+            sp, workdir, jobs=jobs, full=True
+        ),
+        _export_albums_async,
+    ),
+    "import_saved_tracks": (
+        _empty_library,
+        _setup_saved_tracks,
+        lambda spl, sp, workdir, jobs: spl.import_saved_tracks(sp, workdir, jobs=jobs),
+        lambda spl, client, workdir, jobs: spl._import_saved_async(
+            client, f"{workdir}/{spl.constants.FILEPATH_SAVED_TRACKS}", "tracks", jobs
+        ),
+    ),
+    "delete_all": (
+        lambda size: dict(
+            playlists=max(1, size // TRACKS_PER_PLAYLIST // 10),
+            tracks_per_playlist=10,
+            saved_tracks=size,
+            saved_albums=size // 10,
+            saved_shows=size // 100,
+        ),
+        None,
+        _delete_all,
+        lambda spl, client, workdir, jobs: spl.delete_library_async(
+            client, jobs=jobs, assume_yes=True
+        ),
+    ),
+}
+
+
+async def _run_async(spl, name, prefix, workdir, jobs, rate):
+    async with make_async_client(spl, prefix, rate, jobs) as client:
+        await SCENARIOS[name][3](spl, client, workdir, jobs)
+
+
+def _child(name, engine, prefix, workdir, jobs, rate, results):
+    spl = load_script()
+    if engine == "async":
+        start = time.perf_counter()
+        asyncio.run(_run_async(spl, name, prefix, workdir, jobs, rate))
+    else:
+        sp = make_client(spl, prefix, rate, jobs)
+        start = time.perf_counter()
+        SCENARIOS[name][2](spl, sp, workdir, jobs)
+    wall = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux
+    results.put((wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+
+def run_scenario(name, size, args):
+    library, setup, _, _ = SCENARIOS[name]
+    server = fake_spotify.FakeSpotifyServer(
+        fake_spotify.Library(**library(size)),
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+    ).start()
+
+    workdir = tempfile.mkdtemp(prefix="spotify-playlists-bench-")
+    try:
+        if setup is not None:
+            setup(load_script(), workdir, size)
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        process = ctx.Process(
+            target=_child,
+            args=(
+                name,
+                args.engine,
+                server.prefix,
+                workdir,
+                args.jobs,
+                args.rate,
+                results,
+            ),
+        )
+        process.start()
+        wall, peak_rss = results.get()
+        process.join()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "scenario": name,
+        "size": size,
+        "wall_time": wall,
+        "requests": server.requests,
+        "rate_limited": server.rate_limited,
+        "peak_in_flight": server.peak_in_flight,
+        "bytes": server.bytes_sent + server.bytes_received,
+        "peak_rss": peak_rss,
+        "endpoints": server.endpoints,
+    }
+
+
+def print_header():
+    header = (
+        "scenario",
+        "size",
+        "wall [s]",
+        "requests",
+        "429s",
+        "peak",
+        "MiB",
+        "RSS MiB",
+    )
+    print("{:<22} {:>8} {:>10} {:>9} {:>6} {:>6} {:>9} {:>9}".format(*header))
+
+
+def print_row(row):
+    print(
+        "{:<22} {:>8} {:>10.2f} {:>9} {:>6} {:>6} {:>9.1f} {:>9.1f}".format(
+            row["scenario"],
+            row["size"],
+            row["wall_time"],
+            row["requests"],
+            row["rate_limited"],
+            row["peak_in_flight"],
+            row["bytes"] / 2**20,
+            row["peak_rss"] / 2**20,
+        ),
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark spotify-playlists.py against a local fake Spotify Web API"
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="scenario",
+        help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Library sizes in items (default: 1000 10000 100000)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="--jobs of the script (default: 1)"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threads", "async"),
+        default="threads",
+        help="--engine of the script (default: threads)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1e6,
+        help="--rate of the script (default: effectively unlimited)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds the fake API waits before every response (default: 0)",
+    )
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Answer every Nth request with HTTP 429 (default: never)",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=1,
+        help="Retry-After of the injected 429 responses (default: 1)",
+    )
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+
+    print_header()
+    rows = []
+    for name in args.scenarios or SCENARIOS:
+        for size in args.sizes:
+            rows.append(run_scenario(name, size, args))
+            print_row(rows[-1])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
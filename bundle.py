@@ -0,0 +1,178 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Library bundles: a whole export in one gzip compressed JSON lines file.
+
+The first line identifies the format. Every other line is one collection, a
+playlist or a saved collection::
+
+    {"name": ..., "type": "playlist", "location": ..., "public": ...,
+     "collaborative": ..., "new_tracks": [[uri, title, artists], ...],
+     "items": [0, 1, 5, ...]}
+
+``items`` are indices into one track table shared by the whole bundle, so a
+track that is in many playlists is only stored once. The table is built up
+line by line: ``new_tracks`` are the tracks a collection uses for the first
+time, in table order. Bundles can therefore be written and read as a stream.
+"""
+
+import gzip
+import itertools
+import json
+import os
+
+import records
+
+FORMAT = "spotify-playlists-bundle"
+VERSION = 1
+
+
+class BundleWriter:
+    """Write collections to a bundle, replacing ``path`` atomically on close."""
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._index = {}
+        self._file = gzip.open(
+            self._tmp_path, "wt", encoding="utf-8", compresslevel=compresslevel
+        )
+        self._write({"format": FORMAT, "version": VERSION})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def add(
+        self, name, pl_type, tracks, location=None, public=False, collaborative=False
+    ):
+        """Add a collection of records.Track."""
+        new_tracks = []
+        items = []
+        for record in tracks:
+            index = self._index.get(record.uri)
+            if index is None:
+                index = self._index[record.uri] = len(self._index)
+                new_tracks.append([record.uri, record.title, record.artists])
+            items.append(index)
+
+        self._write(
+            {
+                "name": name,
+                "type": pl_type,
+                "location": location,
+                "public": public,
+                "collaborative": collaborative,
+                "new_tracks": new_tracks,
+                "items": items,
+            }
+        )
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+class BundleReader:
+    """Iterate over the collections of a bundle as BundleCollection objects."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, "rt", encoding="utf-8")
+        try:
+            header = json.loads(self._file.readline())
+            if header.get("format") != FORMAT or header.get("version") != VERSION:
+                raise ValueError(f'"{path}" is not a library bundle')
+        except BaseException:
+            self.close()
+            raise
+        self._table = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        for line in self._file:
+            entry = json.loads(line)
+            self._table.extend(
+                records.make_track(title, artists, uri)
+                for uri, title, artists in entry["new_tracks"]
+            )
+            yield BundleCollection(self.path, entry, self._table)
+
+
+class BundleCollection:
+    """One collection of a bundle, with the interface of XspfReader."""
+
+    def __init__(self, bundle_path, entry, table):
+        self.path = f"{bundle_path}#{entry['name'].replace('/', '_')}"
+        self.title = entry["name"]
+        self.location = entry["location"]
+        self.public = entry["public"]
+        self.collaborative = entry["collaborative"]
+        self.pl_type = entry["type"]
+        self.content_hash = None
+        self._items = entry["items"]
+        self._table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __len__(self):
+        return len(self._items)
+
+    def records(self):
+        for index in self._items:
+            yield self._table[index]
+
+    def locations(self):
+        for index in self._items:
+            yield self._table[index].uri
+
+    def batches(self, n):
+        locations = self.locations()
+        while batch := list(itertools.islice(locations, n)):
+            yield batch
+
+
+def read_collection(path, pl_type):
+    """Return the first collection of the given type in a bundle, or None."""
+    with BundleReader(path) as reader:
+        for collection in reader:
+            if collection.pl_type == pl_type:
+                return collection
+    return None
@@ -9,6 +9,30 @@ SCOPES = (
 
 CONFIG_AUTH = "auth.ini"
 
+# request budget shared by all worker threads
+REQUESTS_PER_SECOND = 20
+
+# requests in flight with --engine async unless --jobs is given
+ASYNC_JOBS = 32
+
+# (connect, read) timeouts in seconds by kind of request (scheduler.request_kind).
+# Writes are applied before Spotify answers, and every thread waits for the
+# token endpoint, so a hanging token request should fail early.
+TIMEOUTS = {"read": (5, 15), "write": (5, 30), "auth": (5, 10)}
+
+# seconds until cached playlist lists and saved items are fetched again,
+# cached playlist entries are valid as long as the snapshot_id matches
+CACHE_TTL = 3600
+
+# seconds until URIs checked by --validate are looked up again; the catalog
+# rarely loses items, and only ever existing ids are used with --uri-cache
+URI_CACHE_TTL = 30 * 24 * 3600
+
+# bounds in seconds of the adaptive polling interval of the watch command, and
+# the share of the request budget its polls may use at most
+WATCH_INTERVAL = (30, 900)
+WATCH_RATE_SHARE = 0.1
+
 PLAYLIST_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
 <playlist version="1" xmlns="http://xspf.org/ns/0/">
   <title>{{ title }}</title>
@@ -19,6 +43,9 @@ PLAYLIST_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
     <public>{{ public | string | lower }}</public>
     <collaborative>{{ collaborative | string | lower }}</collaborative>
     <type>{{ pl_type }}</type>
+{%- if content_hash %}
+    <hash>{{ content_hash }}</hash>
+{%- endif %}
   </extension>
   <trackList>
 {%- for track in tracklist %}
@@ -60,6 +87,18 @@ SHOW_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
 </show>
 """
 
+# Parts of the API responses that are actually read. Passed as fields= to the
+# endpoints that support it, the other responses are pruned locally.
+FIELDS_PLAYLISTS = "items(id,name,uri,snapshot_id,public,collaborative,owner(id)),total"
+FIELDS_PLAYLIST_TRACKS = "items(track(name,artists(name),uri)),total"
+FIELDS_PLAYLIST_URIS = "items(track(uri)),total"
+FIELDS_SAVED_TRACKS = "items(added_at,track(id,name,artists(name),uri)),total"
+FIELDS_SAVED_ALBUMS = "items(added_at,album(id,name,artists(name),uri)),total"
+FIELDS_SAVED_SHOWS = "items(added_at,show(id,name,publisher,uri)),total"
+
 FILEPATH_SAVED_TRACKS = "__saved_tracks.xspf"
 FILEPATH_SAVED_ALBUMS = "__saved_albums.xspf"
 FILEPATH_SAVED_SHOWS = "__saved_shows.xspf"
+FILEPATH_MANIFEST = "__manifest.json"
+FILEPATH_BUNDLE = "__library.jsonl.gz"
+FILEPATH_JOURNAL = "__journal.jsonl"
@@ -0,0 +1,597 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for the parts of the Spotify Web API this tool uses.
+
+Only meant for benchmarks: the library lives in memory, there is no
+authentication and responses only contain the fields a real response would
+have that are relevant to their size and to the script.
+"""
+
+import datetime
+import http.server
+import json
+import random
+import string
+import threading
+import time
+import urllib.parse
+
+import field_filter
+
+BASE62 = string.digits + string.ascii_letters
+MARKETS = ["AD", "AR", "AT", "AU", "BE", "BG", "BO", "BR", "CA", "CH", "CL", "CO"] * 8
+
+
+def make_id(kind, n):
+    """Deterministic 22 character base62 id."""
+    digits = []
+    n = n * 4 + {"track": 0, "album": 1, "show": 2, "playlist": 3}[kind]
+    while n:
+        n, rem = divmod(n, 62)
+        digits.append(BASE62[rem])
+    return "".join(reversed(digits)).rjust(22, "0")
+
+
+class Library:
+    """In-memory account: tracks, playlists and saved items."""
+
+    def __init__(
+        self,
+        user_id="bench",
+        playlists=10,
+        tracks_per_playlist=100,
+        saved_tracks=1000,
+        saved_albums=100,
+        saved_shows=20,
+        seed=0,
+    ):
+        self.user_id = user_id
+        self.lock = threading.RLock()
+        self.rng = random.Random(seed)
+        self.catalog_size = max(1, saved_tracks, tracks_per_playlist * 4)
+        self.next_playlist = 0
+        self.playlists = []
+        for _ in range(playlists):
+            start = self.rng.randrange(self.catalog_size)
+            uris = [
+                self.track_uri((start + i) % self.catalog_size)
+                for i in range(tracks_per_playlist)
+            ]
+            self.create_playlist(f"Playlist {self.next_playlist}", uris=uris)
+
+        now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.saved = {}
+        for kind, count in (
+            ("track", saved_tracks),
+            ("album", saved_albums),
+            ("show", saved_shows),
+        ):
+            # uri -> added_at, oldest first so saving an item is a cheap append
+            self.saved[kind] = {
+                f"spotify:{kind}:{make_id(kind, n)}": self.timestamp(
+                    now - datetime.timedelta(minutes=n)
+                )
+                for n in reversed(range(count))
+            }
+        self._saved_views = {}
+
+    @staticmethod
+    def timestamp(when):
+        return when.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def track_uri(n):
+        return f"spotify:track:{make_id('track', n)}"
+
+    def snapshot(self):
+        return "".join(self.rng.choice(BASE62) for _ in range(32))
+
+    def create_playlist(self, name, public=True, collaborative=False, uris=()):
+        with self.lock:
+            playlist_id = make_id("playlist", self.next_playlist)
+            self.next_playlist += 1
+            playlist = {
+                "id": playlist_id,
+                "name": name,
+                "public": public,
+                "collaborative": collaborative,
+                "snapshot_id": self.snapshot(),
+                "items": list(uris),
+            }
+            self.playlists.append(playlist)
+            return playlist
+
+    def saved_newest_first(self, kind):
+        view = self._saved_views.get(kind)
+        if view is None:
+            view = self._saved_views[kind] = list(reversed(self.saved[kind].items()))
+        return view
+
+    def save(self, uri, added_at):
+        kind = uri.split(":")[1]
+        self.saved[kind].pop(uri, None)
+        self.saved[kind][uri] = added_at
+        self._saved_views.pop(kind, None)
+
+    def unsave(self, uri):
+        kind = uri.split(":")[1]
+        self.saved[kind].pop(uri, None)
+        self._saved_views.pop(kind, None)
+
+    def find_playlist(self, playlist_id):
+        for playlist in self.playlists:
+            if playlist["id"] == playlist_id:
+                return playlist
+        raise KeyError(playlist_id)
+
+    # --- JSON objects ---------------------------------------------------
+
+    def playlist_object(self, playlist, base):
+        return {
+            "collaborative": playlist["collaborative"],
+            "description": "",
+            "external_urls": {
+                "spotify": f"https://open.spotify.com/playlist/{playlist['id']}"
+            },
+            "href": f"{base}playlists/{playlist['id']}",
+            "id": playlist["id"],
+            "images": [],
+            "name": playlist["name"],
+            "owner": {"display_name": self.user_id, "id": self.user_id, "type": "user"},
+            "public": playlist["public"],
+            "snapshot_id": playlist["snapshot_id"],
+            "tracks": {
+                "href": f"{base}playlists/{playlist['id']}/tracks",
+                "total": len(playlist["items"]),
+            },
+            "type": "playlist",
+            "uri": f"spotify:playlist:{playlist['id']}",
+        }
+
+    @staticmethod
+    def artist_objects(n):
+        return [
+            {
+                "id": make_id("track", n + i),
+                "name": f"Artist {(n + i) % 997}",
+                "type": "artist",
+                "uri": f"spotify:artist:{make_id('track', n + i)}",
+            }
+            for i in range(1 + n % 2)
+        ]
+
+    def album_object(self, album_id):
+        n = BASE62.index(album_id[-1]) + 62 * BASE62.index(album_id[-2])
+        return {
+            "album_type": "album",
+            "artists": self.artist_objects(n),
+            "available_markets": MARKETS,
+            "id": album_id,
+            "images": [
+                {
+                    "height": size,
+                    "width": size,
+                    "url": f"https://i.scdn.co/image/{album_id}{size}",
+                }
+                for size in (640, 300, 64)
+            ],
+            "name": f"Album {album_id[-6:]}",
+            "release_date": "2020-01-01",
+            "total_tracks": 12,
+            "type": "album",
+            "uri": f"spotify:album:{album_id}",
+        }
+
+    def track_object(self, uri):
+        if uri.startswith("spotify:local:"):
+            return self.local_track_object(uri)
+        track_id = uri.rsplit(":", 1)[1]
+        n = BASE62.index(track_id[-1]) + 62 * BASE62.index(track_id[-2])
+        return {
+            "album": self.album_object(make_id("album", n % 5000)),
+            "artists": self.artist_objects(n),
+            "available_markets": MARKETS,
+            "disc_number": 1,
+            "duration_ms": 180000 + n,
+            "explicit": False,
+            "id": track_id,
+            "name": f"Track {track_id[-6:]}",
+            "popularity": n % 100,
+            "track_number": 1 + n % 12,
+            "type": "track",
+            "uri": uri,
+        }
+
+    @staticmethod
+    def local_track_object(uri):
+        # spotify:local:artist:album:title:seconds
+        artist, album, title, seconds = uri.split(":")[2:]
+        return {
+            "album": {"name": album, "type": "album", "uri": None},
+            "artists": [{"name": artist, "type": "artist", "uri": None}],
+            "duration_ms": int(seconds) * 1000,
+            "id": None,
+            "is_local": True,
+            "name": title,
+            "type": "track",
+            "uri": uri,
+        }
+
+    def show_object(self, uri):
+        show_id = uri.rsplit(":", 1)[1]
+        return {
+            "available_markets": MARKETS,
+            "description": "A show. " * 20,
+            "id": show_id,
+            "images": [],
+            "name": f"Show {show_id[-6:]}",
+            "publisher": f"Publisher {show_id[-3:]}",
+            "type": "show",
+            "uri": uri,
+        }
+
+    def object_for(self, uri):
+        kind = uri.split(":")[1]
+        if kind == "track":
+            return self.track_object(uri)
+        if kind == "album":
+            return self.album_object(uri.rsplit(":", 1)[1])
+        if kind == "show":
+            return self.show_object(uri)
+        return None
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeSpotify/1.0"
+    # headers and body are written separately; with Nagle's algorithm the body
+    # waits for the client's delayed ACK, adding ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing -------------------------------------------------------
+
+    @property
+    def library(self):
+        return self.server.library
+
+    def base(self):
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/v1/"
+
+    def send_json(self, status, body, headers=None):
+        data = (
+            json.dumps(body, separators=(",", ":")).encode()
+            if body is not None
+            else b""
+        )
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.record(self.command, self.endpoint, status, len(data))
+
+    def read_body(self):
+        return json.loads(self.body) if self.body else None
+
+    def page(self, items, params, base_url, make_item=None):
+        limit = int(params.get("limit", 20))
+        offset = int(params.get("offset", 0))
+        window = items[offset : offset + limit]
+        if make_item is not None:
+            # only build the objects of the requested window
+            window = [make_item(item) for item in window]
+        total = len(items)
+        next_url = None
+        if offset + limit < total:
+            query = dict(params, offset=offset + limit, limit=limit)
+            next_url = f"{base_url}?{urllib.parse.urlencode(query)}"
+        result = {
+            "href": base_url,
+            "items": window,
+            "limit": limit,
+            "next": next_url,
+            "offset": offset,
+            "previous": None,
+            "total": total,
+        }
+        if "fields" in params:
+            result = field_filter.project(
+                result, field_filter.parse_fields(params["fields"])
+            )
+        return result
+
+    def handle_any(self):
+        # always consume the body, also for rejected requests on a kept-alive connection
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length)
+        self.server.record_received(length)
+
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.strip("/")
+        if path.startswith("v1/"):
+            path = path[3:]
+        parts = path.split("/")
+        self.endpoint = "/".join(
+            "{id}" if len(part) == 22 or (i == 1 and parts[0] == "users") else part
+            for i, part in enumerate(parts)
+        )
+
+        self.server.enter()
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            retry_after = self.server.throttle()
+            if retry_after is not None:
+                self.send_json(
+                    429,
+                    {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                    {"Retry-After": str(retry_after)},
+                )
+                return
+
+            try:
+                status, body = self.dispatch(self.command, parts, params)
+            except KeyError:
+                status, body = 404, {"error": {"status": 404, "message": "Not found."}}
+            self.send_json(status, body)
+        finally:
+            self.server.leave()
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+    # --- endpoints ------------------------------------------------------
+
+    def dispatch(self, method, parts, params):
+        lib = self.library
+        base = self.base()
+        with lib.lock:
+            if parts == ["me"]:
+                return 200, {
+                    "id": lib.user_id,
+                    "display_name": lib.user_id,
+                    "type": "user",
+                }
+
+            if parts in (["me", "playlists"], ["users", lib.user_id, "playlists"]):
+                if method == "POST":
+                    body = self.read_body()
+                    playlist = lib.create_playlist(
+                        body["name"],
+                        body.get("public", True),
+                        body.get("collaborative", False),
+                    )
+                    return 201, lib.playlist_object(playlist, base)
+                return 200, self.page(
+                    lib.playlists,
+                    params,
+                    base + "/".join(parts),
+                    lambda playlist: lib.playlist_object(playlist, base),
+                )
+
+            if parts[0] == "playlists" and len(parts) >= 2:
+                playlist = lib.find_playlist(parts[1])
+                if len(parts) == 2:
+                    if method == "PUT":
+                        body = self.read_body()
+                        for key in ("name", "public", "collaborative"):
+                            if key in body:
+                                playlist[key] = body[key]
+                        return 200, None
+                    return 200, lib.playlist_object(playlist, base)
+                if parts[2] == "followers" and method == "DELETE":
+                    lib.playlists.remove(playlist)
+                    return 200, None
+                if parts[2] in ("tracks", "items"):
+                    return self.playlist_items(
+                        playlist, method, params, base + "/".join(parts)
+                    )
+
+            if (
+                parts[0] == "me"
+                and len(parts) >= 2
+                and parts[1] in ("tracks", "albums", "shows", "library")
+            ):
+                return self.saved_items(method, parts, params, base + "/".join(parts))
+
+            if len(parts) == 1 and parts[0] in (
+                "tracks",
+                "albums",
+                "shows",
+                "episodes",
+            ):
+                kind = parts[0][:-1]
+                objects = [
+                    (
+                        lib.object_for(f"spotify:{kind}:{item_id}")
+                        if self.server.is_valid(item_id)
+                        else None
+                    )
+                    for item_id in params["ids"].split(",")
+                ]
+                return 200, {parts[0]: objects}
+
+        raise KeyError(parts)
+
+    def playlist_items(self, playlist, method, params, base_url):
+        lib = self.library
+        if method == "GET":
+            return 200, self.page(
+                playlist["items"],
+                params,
+                base_url,
+                lambda uri: {
+                    "added_at": "2024-01-01T00:00:00Z",
+                    "is_local": uri.startswith("spotify:local:"),
+                    "track": lib.track_object(uri),
+                },
+            )
+
+        body = self.read_body()
+        if method == "POST":
+            uris = body["uris"] if isinstance(body, dict) else body
+            if not all(self.server.is_valid_uri(uri) for uri in uris):
+                return 400, {"error": {"status": 400, "message": "Invalid base62 id"}}
+            position = params.get("position")
+            position = len(playlist["items"]) if position is None else int(position)
+            playlist["items"][position:position] = uris
+        elif method == "PUT" and "range_start" in body:
+            start, length = body["range_start"], body.get("range_length", 1)
+            before = body["insert_before"]
+            moved = playlist["items"][start : start + length]
+            del playlist["items"][start : start + length]
+            if before > start:
+                before -= length
+            playlist["items"][before:before] = moved
+        elif method == "PUT":
+            playlist["items"] = list(body["uris"])
+        elif method == "DELETE":
+            remove = set()
+            for entry in body.get("items") or body.get("tracks"):
+                for position in entry["positions"]:
+                    if playlist["items"][position] != entry["uri"]:
+                        return 400, {
+                            "error": {"status": 400, "message": "Invalid track uri"}
+                        }
+                    remove.add(position)
+            playlist["items"] = [
+                uri for i, uri in enumerate(playlist["items"]) if i not in remove
+            ]
+        playlist["snapshot_id"] = lib.snapshot()
+        return 201, {"snapshot_id": playlist["snapshot_id"]}
+
+    def saved_items(self, method, parts, params, base_url):
+        lib = self.library
+        if parts[1] == "library":
+            uris = params["uris"].split(",")
+        elif "ids" in params:
+            uris = [
+                f"spotify:{parts[1][:-1]}:{item_id}"
+                for item_id in params["ids"].split(",")
+            ]
+        else:
+            uris = []
+
+        if parts[-1] == "contains":
+            return 200, [uri in lib.saved.get(uri.split(":")[1], ()) for uri in uris]
+
+        if method == "GET":
+            kind = parts[1][:-1]
+            return 200, self.page(
+                lib.saved_newest_first(kind),
+                params,
+                base_url,
+                lambda entry: {"added_at": entry[1], kind: lib.object_for(entry[0])},
+            )
+
+        if not all(self.server.is_valid_uri(uri) for uri in uris):
+            return 400, {"error": {"status": 400, "message": "Invalid base62 id"}}
+
+        now = lib.timestamp(datetime.datetime.now(datetime.timezone.utc))
+        for uri in uris:
+            if method == "PUT":
+                lib.save(uri, now)
+            else:
+                lib.unsave(uri)
+        return 200, None
+
+
+class FakeSpotifyServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server with request accounting and 429 injection."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        library,
+        address=("127.0.0.1", 0),
+        latency=0.0,
+        rate_limit_every=0,
+        retry_after=1,
+        invalid_ids=(),
+    ):
+        super().__init__(address, Handler)
+        self.library = library
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.invalid_ids = set(invalid_ids)
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rate_limited = 0
+        self.endpoints = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @property
+    def prefix(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1/"
+
+    def is_valid(self, item_id):
+        return item_id not in self.invalid_ids
+
+    def is_valid_uri(self, uri):
+        parts = uri.split(":")
+        return (
+            len(parts) == 3
+            and parts[0] == "spotify"
+            and len(parts[2]) == 22
+            and self.is_valid(parts[2])
+        )
+
+    def throttle(self):
+        with self.stats_lock:
+            if (
+                self.rate_limit_every
+                and (self.requests + self.rate_limited + 1) % self.rate_limit_every == 0
+            ):
+                return self.retry_after
+        return None
+
+    def enter(self):
+        with self.stats_lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.stats_lock:
+            self.in_flight -= 1
+
+    def record_received(self, size):
+        with self.stats_lock:
+            self.bytes_received += size
+
+    def record(self, method, endpoint, status, size):
+        with self.stats_lock:
+            if status == 429:
+                self.rate_limited += 1
+            else:
+                self.requests += 1
+            self.bytes_sent += size
+            key = f"{method} {endpoint}"
+            self.endpoints[key] = self.endpoints.get(key, 0) + 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
@@ -0,0 +1,60 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The ``fields`` filter of Web API requests, applied locally.
+
+Used for endpoints that don't support the filter and by the fake API of the
+benchmarks, so both prune responses the same way.
+"""
+
+
+def parse_fields(fields):
+    """Parse a Web API ``fields`` filter like ``items(track(name,uri)),total``."""
+
+    def parse(pos):
+        spec = {}
+        name = ""
+        while pos < len(fields):
+            char = fields[pos]
+            if char == "(":
+                spec[name], pos = parse(pos + 1)
+                name = ""
+            elif char == ")":
+                break
+            elif char == ",":
+                if name:
+                    spec[name] = None
+                name = ""
+            else:
+                name += char
+            pos += 1
+        if name:
+            spec[name] = None
+        return spec, pos
+
+    return parse(0)[0]
+
+
+def project(value, spec):
+    """Keep only the parts of a response selected by a parsed fields filter."""
+    if spec is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: project(value[key], sub) for key, sub in spec.items() if key in value
+        }
+    return value
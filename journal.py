@@ -0,0 +1,151 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """Append-only record of the work an import or export has completed.
+
+    Every record is a key (a tuple of strings) and a JSON value, one JSON
+    object per line; a later record for the same key replaces the earlier one.
+    Records are written to the file right away but only fsync'd every
+    ``sync_every`` records or ``sync_interval`` seconds and on close, so a
+    crash loses at most the progress made since the last sync. Callers must
+    therefore only use the journal to skip work that is safe to repeat.
+
+    With ``resume`` the records of a previous run of the same command are
+    loaded, otherwise the journal starts empty. ``close(complete=True)``
+    removes the file once the command finished.
+    """
+
+    def __init__(self, path, command, resume=False, sync_every=64, sync_interval=1.0):
+        self.path = path
+        self.command = command
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._records = {}
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            logger.info('starting over, ignoring journal "%s"', path)
+
+        # start from a compacted copy, replaced atomically so that a crash
+        # right now doesn't lose the records being resumed from
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(f"{path}.tmp", "w", encoding="utf-8")
+        self._write({"command": command})
+        for key, value in self._records.items():
+            self._write({"key": list(key), "value": value})
+        self._sync()
+        self._file.close()
+        os.replace(f"{path}.tmp", path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            logger.info('no journal "%s" to resume from', self.path)
+            return
+
+        records = {}
+        for n, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may have been cut off by the crash
+                break
+            if n == 0:
+                if entry.get("command") != self.command:
+                    logger.warning(
+                        'journal "%s" belongs to "%s", starting over',
+                        self.path,
+                        entry.get("command"),
+                    )
+                    return
+                continue
+            records[tuple(entry["key"])] = entry["value"]
+
+        self._records = records
+        logger.info('resuming from journal "%s"', self.path)
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")))
+        self._file.write("\n")
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._records.get(key, default)
+
+    def record(self, key, value=True):
+        with self._lock:
+            self._records[key] = value
+            self._write({"key": list(key), "value": value})
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.sync_every
+                or time.monotonic() - self._synced_at >= self.sync_interval
+            ):
+                self._sync()
+
+    def close(self, complete=False):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+            if complete:
+                os.remove(self.path)
+
+
+def open_journal(path, command, resume=False):
+    """Journal at path, or a context of None if it can't be written there.
+
+    Imports read from read-only directories too, they just can't be resumed.
+    """
+    try:
+        return Journal(path, command, resume=resume)
+    except OSError as e:
+        logger.warning(
+            'cannot write journal "%s" (%s), continuing without it',
+            path,
+            e.strerror or e,
+        )
+        return contextlib.nullcontext()
@@ -0,0 +1,299 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    collection TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    public INTEGER,
+    collaborative INTEGER,
+    owner_id TEXT,
+    PRIMARY KEY (collection, position)
+);
+CREATE TABLE IF NOT EXISTS playlist_entries (
+    collection TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    uri TEXT,
+    title TEXT,
+    artists TEXT,
+    PRIMARY KEY (collection, position)
+);
+CREATE TABLE IF NOT EXISTS saved_items (
+    collection TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    uri TEXT NOT NULL,
+    title TEXT,
+    artists TEXT,
+    added_at TEXT,
+    PRIMARY KEY (collection, position)
+);
+"""
+
+
+def _playlist_row(item):
+    return (
+        item["id"],
+        item["name"],
+        item["uri"],
+        item["snapshot_id"],
+        item.get("public"),
+        item.get("collaborative"),
+        item.get("owner", {}).get("id"),
+    )
+
+
+def _playlist_item(row):
+    playlist_id, name, uri, snapshot_id, public, collaborative, owner_id = row
+    return {
+        "id": playlist_id,
+        "name": name,
+        "uri": uri,
+        "snapshot_id": snapshot_id,
+        "public": None if public is None else bool(public),
+        "collaborative": None if collaborative is None else bool(collaborative),
+        "owner": {"id": owner_id},
+    }
+
+
+def _entry_row(item):
+    track = item["track"]
+    if track is None:
+        return (None, None, None)
+    return (
+        track["uri"],
+        track.get("name"),
+        json.dumps([artist["name"] for artist in track.get("artists", [])]),
+    )
+
+
+def _entry_item(row):
+    uri, title, artists = row
+    if uri is None:
+        return {"track": None}
+    return {
+        "track": {
+            "name": title,
+            "artists": [{"name": name} for name in json.loads(artists)],
+            "uri": uri,
+        }
+    }
+
+
+def _saved_converters(key):
+    """Row converters for saved tracks/albums ("artists") or shows ("publisher")."""
+
+    def to_row(item):
+        obj = item[key]
+        if key == "show":
+            artists = obj.get("publisher")
+        else:
+            artists = json.dumps([artist["name"] for artist in obj.get("artists", [])])
+        return (obj.get("id"), obj["uri"], obj.get("name"), artists, item["added_at"])
+
+    def from_row(row):
+        item_id, uri, title, artists, added_at = row
+        obj = {"id": item_id, "name": title, "uri": uri}
+        if key == "show":
+            obj["publisher"] = artists
+        else:
+            obj["artists"] = [{"name": name} for name in json.loads(artists)]
+        return {"added_at": added_at, key: obj}
+
+    return to_row, from_row
+
+
+TABLES = {
+    "playlists": (
+        ("id", "name", "uri", "snapshot_id", "public", "collaborative", "owner_id"),
+        _playlist_row,
+        _playlist_item,
+    ),
+    "playlist_entries": (("uri", "title", "artists"), _entry_row, _entry_item),
+}
+
+
+def connect(path, schema):
+    """Open the SQLite file at path for all threads and create schema in it.
+
+    Batch runs share the file between processes, the connection waits for
+    their writes instead of failing.
+    """
+    db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(schema)
+    db.commit()
+    return db
+
+
+class LibraryCache:
+    """On-disk SQLite copy of one account's library.
+
+    Playlists, playlist entries and saved tracks, albums and shows are stored
+    in tables and served in the same page format as the (projected) API
+    responses, so any paged fetch can be wrapped transparently. Playlist
+    entries are valid as long as the playlist's snapshot_id is unchanged,
+    everything else for ``ttl`` seconds.
+    """
+
+    def __init__(self, path, account, ttl=3600):
+        self.path = path
+        self.account = account
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = connect(path, SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def playlists(self, fetch):
+        """Wrap a fetch of the account's playlists (FIELDS_PLAYLISTS)."""
+        return _CachedFetch(self, "playlists", f"playlists:{self.account}", "", fetch)
+
+    def playlist_entries(self, playlist_id, snapshot_id, fetch):
+        """Wrap a fetch of a playlist's items (FIELDS_PLAYLIST_TRACKS)."""
+        if snapshot_id is None:
+            return fetch
+        return _CachedFetch(
+            self,
+            "playlist_entries",
+            f"entries:{self.account}:{playlist_id}",
+            snapshot_id,
+            fetch,
+        )
+
+    def saved(self, kind, fetch):
+        """Wrap a fetch of saved "tracks", "albums" or "shows" (FIELDS_SAVED_*)."""
+        return _CachedFetch(
+            self, "saved_items", f"saved:{self.account}:{kind}", "", fetch, kind[:-1]
+        )
+
+    def invalidate_playlists(self):
+        self._invalidate(f"playlists:{self.account}")
+
+    def invalidate_saved(self, kind):
+        self._invalidate(f"saved:{self.account}:{kind}")
+
+    def _invalidate(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM collections WHERE key = ?", (key,))
+            self._db.commit()
+
+
+class _CachedFetch:
+    """A fetch(limit=..., offset=...) served from the cache when it is fresh.
+
+    Otherwise the pages are fetched from the API and stored as they pass
+    through. The collection becomes fresh once every position up to the
+    total has been stored, no matter in which order the pages arrived.
+    """
+
+    def __init__(self, cache, table, key, version, fetch, saved_key=None):
+        self.cache = cache
+        self.table = table
+        self.key = key
+        self.version = version
+        self.fetch = fetch
+        if saved_key is not None:
+            self.columns = ("id", "uri", "title", "artists", "added_at")
+            self.to_row, self.from_row = _saved_converters(saved_key)
+        else:
+            self.columns, self.to_row, self.from_row = TABLES[table]
+        self._filling = False
+        self._stored = set()
+
+    def _fresh(self):
+        row = self.cache._db.execute(
+            "SELECT version, total, complete, fetched_at FROM collections WHERE key = ?",
+            (self.key,),
+        ).fetchone()
+        if row is None:
+            return None
+        version, total, complete, fetched_at = row
+        if not complete or version != self.version:
+            return None
+        if (
+            self.table != "playlist_entries"
+            and time.time() - fetched_at > self.cache.ttl
+        ):
+            return None
+        return total
+
+    def __call__(self, limit=50, offset=0, **kwargs):
+        with self.cache._lock:
+            total = None if self._filling else self._fresh()
+            if total is not None:
+                rows = self.cache._db.execute(
+                    f"SELECT {', '.join(self.columns)} FROM {self.table} "
+                    "WHERE collection = ? AND position >= ? ORDER BY position LIMIT ?",
+                    (self.key, offset, limit),
+                ).fetchall()
+                return {"items": [self.from_row(row) for row in rows], "total": total}
+
+        page = self.fetch(limit=limit, offset=offset, **kwargs)
+        self._store(page, offset)
+        return page
+
+    def _store(self, page, offset):
+        db = self.cache._db
+        with self.cache._lock:
+            if not self._filling:
+                # first API page of this run, start over
+                self._filling = True
+                db.execute("DELETE FROM collections WHERE key = ?", (self.key,))
+                db.execute(
+                    f"DELETE FROM {self.table} WHERE collection = ?", (self.key,)
+                )
+
+            placeholders = ", ".join("?" * (len(self.columns) + 2))
+            db.executemany(
+                f"INSERT OR REPLACE INTO {self.table} "
+                f"(collection, position, {', '.join(self.columns)}) VALUES ({placeholders})",
+                [
+                    (self.key, offset + i, *self.to_row(item))
+                    for i, item in enumerate(page["items"])
+                ],
+            )
+            self._stored.update(range(offset, offset + len(page["items"])))
+
+            total = page["total"]
+            complete = len(self._stored) >= total
+            db.execute(
+                "INSERT OR REPLACE INTO collections (key, version, total, complete, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.key, self.version, total, int(complete), time.time()),
+            )
+            db.commit()
+            if complete:
+                self._filling = False
+                self._stored.clear()
@@ -0,0 +1,66 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import sys
+
+# A track, album or show as it is exported. For albums "artists" are the album
+# artists, for shows the publisher.
+Track = collections.namedtuple("Track", ("title", "artists", "uri"))
+
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+
+def make_track(title, artists, uri):
+    """Return a Track whose strings are shared with all equal Track strings.
+
+    The same track is usually in several playlists and the same artists on
+    many tracks, so records that are kept around only store them once.
+    """
+    return Track(_intern(title), _intern(artists), _intern(uri))
+
+
+# rendered in place of a ContentHash digest until all items have been written
+HASH_PLACEHOLDER = "?" * 64
+
+
+class ContentHash:
+    """SHA-256 of an ordered list of URIs.
+
+    It only depends on the URIs and their order, so the hash stored in an
+    exported file can be compared with one of a uri-only fetch of the live
+    playlist.
+    """
+
+    def __init__(self, uris=()):
+        self._hash = hashlib.sha256()
+        for uri in uris:
+            self.update(uri)
+
+    def update(self, uri):
+        self._hash.update(uri.encode("utf-8"))
+        self._hash.update(b"\n")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def feed(self, tracks):
+        """Yield the records of tracks, adding their URIs on the way."""
+        for track in tracks:
+            self.update(track.uri)
+            yield track
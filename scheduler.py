@@ -0,0 +1,318 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+import spotipy
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+# spotipy.Spotify methods that modify the library, they are scheduled ahead of reads
+WRITE_METHODS = frozenset(
+    (
+        "current_user_saved_albums_add",
+        "current_user_saved_albums_delete",
+        "current_user_saved_shows_add",
+        "current_user_saved_shows_delete",
+        "current_user_saved_tracks_add",
+        "current_user_saved_tracks_delete",
+        "current_user_unfollow_playlist",
+        "playlist_add_items",
+        "playlist_change_details",
+        "playlist_remove_specific_occurrences_of_items",
+        "playlist_reorder_items",
+        "playlist_replace_items",
+        "user_playlist_add_tracks",
+        "user_playlist_change_details",
+        "user_playlist_create",
+    )
+)
+
+
+# writes that set the library to a given state, so they can be repeated after a
+# 5xx. Other writes may have been applied anyway and retrying them could add
+# tracks or create a playlist twice, or move and remove the wrong items since
+# positions changed; only reads and these writes are retried
+IDEMPOTENT_WRITE_METHODS = frozenset(
+    (
+        "current_user_saved_albums_add",
+        "current_user_saved_albums_delete",
+        "current_user_saved_shows_add",
+        "current_user_saved_shows_delete",
+        "current_user_saved_tracks_add",
+        "current_user_saved_tracks_delete",
+        "current_user_unfollow_playlist",
+        "playlist_change_details",
+        "playlist_replace_items",
+        "user_playlist_change_details",
+    )
+)
+
+
+def request_kind(request):
+    """Classify a request for its timeout: "auth", "read" or "write"."""
+    if urllib.parse.urlsplit(request.url).hostname == "accounts.spotify.com":
+        return "auth"
+    return "read" if request.method == "GET" else "write"
+
+
+class TimeoutAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that applies the timeout of the kind of every request.
+
+    ``timeouts`` maps the kinds of request_kind() to a requests timeout. They
+    replace the single ``requests_timeout`` spotipy passes for all calls.
+    """
+
+    def __init__(self, timeouts, **kwargs):
+        self.timeouts = timeouts
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        timeout = self.timeouts.get(request_kind(request), timeout)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def default_pool_size(jobs):
+    """Connections needed to keep one alive for every thread of a run with jobs workers.
+
+    Workers that page through playlists share the jobs threads between them
+    (see split_jobs() in spotify-playlists.py), a few more connections cover
+    the token refresh and requests made while pages are fetched.
+    """
+    return max(10, jobs + 4)
+
+
+def build_session(pool_size=10, timeouts=None):
+    """Return a requests session that leaves status code retries to the scheduler.
+
+    Connection errors are still retried by urllib3, but 429 and 5xx responses
+    are passed through (including their Retry-After header) instead of being
+    slept on inside a single thread.
+
+    Up to ``pool_size`` connections per host are kept alive for reuse, it
+    should be at least the number of threads making requests. ``timeouts``
+    are passed to TimeoutAdapter, by default spotipy's timeout applies.
+    """
+    session = requests.Session()
+    # requests sends these by default, they are spelled out because the whole
+    # point of the shared session is compressed responses on reused connections
+    session.headers.update(
+        {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    )
+    retry = urllib3.Retry(
+        total=3,
+        read=False,
+        status=0,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        backoff_factor=0.3,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = TimeoutAdapter(timeouts or {}, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class SharedSpotifyOAuth(spotipy.oauth2.SpotifyOAuth):
+    """SpotifyOAuth whose token is shared by all threads and refreshed by one.
+
+    spotipy reads the token cache file for every API call, and every thread
+    that finds the token expired refreshes it on its own. Here the token is
+    kept in memory; when it is missing or about to expire, the first thread
+    loads or refreshes it under a lock and the others wait for its result.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+        self._token_info = None
+
+    def _current_token(self):
+        token_info = self._token_info
+        if token_info is None or self.is_token_expired(token_info):
+            return None
+        return token_info
+
+    def get_access_token(self, code=None, as_dict=True, check_cache=True):
+        if code is not None or not check_cache:
+            with self._token_lock:
+                self._token_info = None
+                return super().get_access_token(
+                    code=code, as_dict=as_dict, check_cache=check_cache
+                )
+
+        token_info = self._current_token()
+        if token_info is None:
+            with self._token_lock:
+                # another thread may have refreshed the token while we waited
+                token_info = self._current_token()
+                if token_info is None:
+                    # refreshes the cached token if it expired
+                    token_info = self.validate_token(
+                        self.cache_handler.get_cached_token()
+                    )
+                    if token_info is None:
+                        # no usable cached token, log in
+                        super().get_access_token(as_dict=False, check_cache=False)
+                        token_info = self.cache_handler.get_cached_token()
+                    self._token_info = token_info
+        return token_info if as_dict else token_info["access_token"]
+
+
+class TokenBucket:
+    """Request budget shared by all threads.
+
+    Tokens are refilled at ``rate`` per second up to ``burst``. Callers wait in
+    a priority queue: writes go before reads, and callers of the same kind are
+    served in arrival order. ``pause()`` stops everyone, e.g. after a 429.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, write=False):
+        ticket = (0 if write else 1, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queue[0] != ticket:
+                        # the head of the queue wakes us up once it got its token
+                        self._cond.wait()
+                        continue
+                    if now < self._paused_until:
+                        self._cond.wait(self._paused_until - now)
+                    elif self._tokens < 1:
+                        self._cond.wait((1 - self._tokens) / self.rate)
+                    else:
+                        self._tokens -= 1
+                        return
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    @property
+    def paused(self):
+        return time.monotonic() < self._paused_until
+
+
+class ScheduledSpotify:
+    """Proxy for spotipy.Spotify that sends every API call through a TokenBucket.
+
+    A 429 response pauses the whole bucket for the time given in Retry-After,
+    5xx responses of reads and IDEMPOTENT_WRITE_METHODS are retried with
+    jittered exponential backoff. Time spent waiting is reported to ``stats`` (a
+    stats.ApiStats) if given.
+    """
+
+    def __init__(
+        self, sp, bucket, max_retries=8, backoff=0.5, max_backoff=30, stats=None
+    ):
+        self._sp = sp
+        self._bucket = bucket
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self._sp, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        write = name in WRITE_METHODS
+        idempotent = not write or name in IDEMPOTENT_WRITE_METHODS
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return self._call(attr, write, idempotent, args, kwargs)
+
+        return call
+
+    def _call(self, method, write, idempotent, args, kwargs):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            self._bucket.acquire(write)
+            if self._stats is not None:
+                self._stats.record_wait("rate budget", time.monotonic() - start)
+            try:
+                return method(*args, **kwargs)
+            except spotipy.SpotifyException as e:
+                if attempt >= self._max_retries:
+                    raise
+                if e.http_status == 429:
+                    delay = self._retry_after(e)
+                    logger.warning("rate limited, pausing requests for %.1f s", delay)
+                    self._bucket.pause(delay)
+                elif e.http_status is not None and e.http_status >= 500:
+                    if not idempotent:
+                        logger.error(
+                            "server error %d in %s, not retried since it may have "
+                            "been applied; run the command again to finish",
+                            e.http_status,
+                            method.__name__,
+                        )
+                        raise
+                    delay = random.uniform(
+                        0, min(self._max_backoff, self._backoff * 2**attempt)
+                    )
+                    logger.warning(
+                        "server error %d, retrying in %.1f s", e.http_status, delay
+                    )
+                    if self._stats is not None:
+                        self._stats.record_wait("backoff", delay)
+                    time.sleep(delay)
+                else:
+                    raise
+                if self._stats is not None:
+                    self._stats.record_retry()
+                attempt += 1
+
+    def _retry_after(self, exception):
+        try:
+            return float((exception.headers or {})["Retry-After"])
+        except (KeyError, ValueError):
+            return min(self._max_backoff, self._backoff * 2)
@@ -16,8 +16,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import asyncio
+import collections
+import concurrent.futures
 import configparser
+import difflib
+import functools
+import json
+import itertools
 import os
+import queue
+import signal
+import sys
+import threading
+import time
 import xml.etree.ElementTree
 import logging
 import glob
@@ -28,7 +40,22 @@ import spotipy.cache_handler
 import spotipy.oauth2
 import spotipy.util
 
+import bundle
 import constants
+import field_filter
+import journal
+import library_cache
+import records
+import scheduler
+import stats
+import uri_validation
+import watch
+
+try:
+    import async_client
+except ImportError:
+    # aiohttp is only needed for --engine async
+    async_client = None
 
 # Configure the logger
 logging.basicConfig(
@@ -42,132 +69,313 @@ def chunks(lst, n):
         yield lst[i : i + n]
 
 
-def delete_all_user_playlists(sp):
-    # Get the current user’s ID
-    user_id = sp.current_user()["id"]
-
-    # Start fetching playlists with pagination
-    playlists = sp.current_user_playlists(limit=50)
-
-    confirmation = input(
-        f"Do you really want to delete all playlists from account '{user_id}'? (yes/no): "
+def batched(iterable, n):
+    """Like chunks(), but for any iterable."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, n)):
+        yield batch
+
+
+def iter_in_background(iterable, maxsize=2):
+    """Produce the items of iterable on a separate thread.
+
+    Used to parse a file while the previous batch is sent to the API.
+    """
+    items = queue.Queue(maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if it waits for a free slot
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def projected(fetch, fields, remote=False):
+    """Return fetch limited to the given fields.
+
+    Endpoints that support it (remote) get the filter as ``fields=``, all
+    others are pruned as soon as the response arrives, so the full objects
+    with images and markets never pile up in memory.
+    """
+    if remote:
+        return functools.partial(fetch, fields=fields)
+
+    spec = field_filter.parse_fields(fields)
+
+    def fetch_projected(*args, **kwargs):
+        return field_filter.project(fetch(*args, **kwargs), spec)
+
+    return fetch_projected
+
+
+def _playlists_fetch(sp, username, cache=None):
+    fetch = projected(
+        functools.partial(sp.user_playlists, username), constants.FIELDS_PLAYLISTS
     )
+    return cache.playlists(fetch) if cache is not None else fetch
+
+
+def _playlist_items_fetch(sp, playlist_id, fields, snapshot_id=None, cache=None):
+    if cache is not None and snapshot_id is not None:
+        # cache complete entries so every caller can reuse them
+        fields = constants.FIELDS_PLAYLIST_TRACKS
+    fetch = projected(functools.partial(sp.playlist_items, playlist_id), fields, True)
+    if cache is not None:
+        return cache.playlist_entries(playlist_id, snapshot_id, fetch)
+    return fetch
+
+
+def _saved_fetch(sp, kind, cache=None):
+    fetch, fields = {
+        "tracks": (sp.current_user_saved_tracks, constants.FIELDS_SAVED_TRACKS),
+        "albums": (sp.current_user_saved_albums, constants.FIELDS_SAVED_ALBUMS),
+        "shows": (sp.current_user_saved_shows, constants.FIELDS_SAVED_SHOWS),
+    }[kind]
+    fetch = projected(fetch, fields)
+    return cache.saved(kind, fetch) if cache is not None else fetch
+
+
+def iter_pages(fetch, limit=50, jobs=1, first=None, reverse=False):
+    """Yield all pages of a paged collection in order.
+
+    ``fetch`` is called as ``fetch(limit=..., offset=...)`` and returns one page.
+    The first page tells us the ``total``; the remaining offset windows are then
+    fetched on up to ``jobs`` threads and yielded in order. An already fetched
+    first page can be passed as ``first``.
+
+    With ``reverse`` the pages are yielded from the last one to the first, so
+    the items of a page can be removed as soon as it is yielded: that only
+    shifts the items after it, which have all been fetched already.
+    """
+    page = first if first is not None else fetch(limit=limit, offset=0)
+    if not reverse:
+        yield page
+
+    offsets = range(limit, page["total"], limit)
+    if reverse:
+        offsets = offsets[::-1]
+    if jobs <= 1 or len(offsets) <= 1:
+        for offset in offsets:
+            yield fetch(limit=limit, offset=offset)
+        if reverse:
+            yield page
+        return
 
-    # Loop through playlists and ask for confirmation before deletion
-    while playlists:
-        for playlist in playlists["items"]:
-            if (
-                playlist["owner"]["id"] == user_id
-            ):  # Check if the user owns the playlist
-                if confirmation.lower() == "yes":
-                    sp.current_user_unfollow_playlist(playlist["id"])
-                    logger.info("Deleted playlist: %s", playlist["name"])
-                else:
-                    logger.info("Skipped deletion of playlist: %s", playlist["name"])
-
-        # Continue to the next page of playlists
-        playlists = sp.next(playlists) if playlists["next"] else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        # keep a bounded window of requests in flight so a slow consumer
+        # doesn't make all pages of a huge collection pile up in memory
+        pending = collections.deque()
+        for offset in offsets:
+            pending.append(executor.submit(fetch, limit=limit, offset=offset))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    if reverse:
+        yield page
+
+
+def run_pipelined(calls, jobs=1):
+    """Run the zero-argument callables from an iterable on up to jobs threads.
+
+    The iterable is consumed while the calls are running, with a bounded
+    number of them in flight, so producing the next calls (e.g. fetching the
+    next page) overlaps with running the previous ones.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for call in calls:
+            pending.append(executor.submit(call))
+            while pending and pending[0].done():
+                pending.popleft().result()
+            if len(pending) >= 2 * jobs:
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+
+
+def split_jobs(jobs, tasks):
+    """Share jobs threads between tasks that each page through a collection.
+
+    Returns (workers, page_jobs): up to workers tasks run at the same time
+    and each fetches its pages on page_jobs threads, so that no more than
+    jobs requests are in flight. One task gets all of them for its pages.
+    """
+    workers = max(1, min(jobs, tasks))
+    return workers, max(1, jobs // workers)
+
+
+def map_pipelined(
+    function, iterable, jobs=1, executor_class=concurrent.futures.ThreadPoolExecutor
+):
+    """Like map(), but on up to jobs threads with a bounded number of calls in flight.
 
+    With a ProcessPoolExecutor as executor_class the calls run on jobs
+    processes instead, so function, its arguments and results must be picklable.
+    """
+    if jobs <= 1:
+        yield from map(function, iterable)
+        return
+    with executor_class(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
-def delete_all_saved_tracks(sp):
-    """Retrieve all saved tracks for the user and delete them after confirmation."""
 
-    # Fetch all saved tracks with pagination
-    saved_tracks = sp.current_user_saved_tracks(limit=50)
-    all_track_ids = [item["track"]["id"] for item in saved_tracks["items"]]
+def _confirm(prompt, assume_yes=False):
+    if assume_yes:
+        logger.info("%s yes", prompt)
+        return "yes"
+    return input(prompt)
 
-    while saved_tracks["next"]:
-        saved_tracks = sp.next(saved_tracks)
-        all_track_ids.extend(item["track"]["id"] for item in saved_tracks["items"])
 
-    if not all_track_ids:
-        logger.info("No saved tracks found.")
-        return
+def delete_all_user_playlists(sp, jobs=1, cache=None, assume_yes=False):
+    # Get the current user’s ID
+    user_id = sp.current_user()["id"]
 
-    # Confirm deletion with the user
-    confirmation = input(
-        f"You have {len(all_track_ids)} saved tracks. Do you want to delete them all? (yes/no): "
+    confirmation = _confirm(
+        f"Do you really want to delete all playlists from account '{user_id}'? (yes/no): ",
+        assume_yes,
     )
+    fetch = _playlists_fetch(sp, user_id, cache)
+
     if confirmation.lower() != "yes":
-        logger.info("Operation cancelled. No tracks were deleted.")
+        for page in iter_pages(fetch, limit=50, jobs=jobs):
+            for playlist in page["items"]:
+                if playlist["owner"]["id"] == user_id:
+                    logger.info("Skipped deletion of playlist: %s", playlist["name"])
         return
 
-    # Delete tracks in chunks of 50 (Spotify API limit)
-    for i in range(0, len(all_track_ids), 50):
-        chunk = all_track_ids[i : i + 50]
-        sp.current_user_saved_tracks_delete(tracks=chunk)
-        logger.info("Deleted %d tracks from saved tracks.", len(chunk))
-
-    logger.info("All saved tracks have been deleted.")
+    def unfollow(playlist):
+        sp.current_user_unfollow_playlist(playlist["id"])
+        logger.info("Deleted playlist: %s", playlist["name"])
+
+    # Unfollow the playlists of each page while the pages before it are
+    # fetched, from the end so unfollowing doesn't shift unfetched offsets.
+    # Fetching and unfollowing share the jobs threads.
+    page_jobs = max(1, jobs // 2)
+    run_pipelined(
+        (
+            functools.partial(unfollow, playlist)
+            for page in iter_pages(fetch, limit=50, jobs=page_jobs, reverse=True)
+            for playlist in page["items"]
+            if playlist["owner"]["id"] == user_id  # Check if the user owns the playlist
+        ),
+        jobs=max(1, jobs - page_jobs),
+    )
 
+    if cache is not None:
+        cache.invalidate_playlists()
 
-def delete_all_saved_albums(sp):
-    """Retrieve all saved albums for the user and delete them after confirmation."""
 
-    # Fetch all saved albums with pagination
-    saved_albums = sp.current_user_saved_albums(limit=50)
-    all_album_ids = [item["album"]["id"] for item in saved_albums["items"]]
+def _delete_saved_items(sp, kind, delete, jobs=1, cache=None, assume_yes=False):
+    """Delete a saved collection after confirmation, page by page while paging."""
+    key = kind[:-1]
+    fetch = _saved_fetch(sp, kind, cache)
+    first = fetch(limit=50, offset=0)
 
-    while saved_albums["next"]:
-        saved_albums = sp.next(saved_albums)
-        all_album_ids.extend(item["album"]["id"] for item in saved_albums["items"])
-
-    if not all_album_ids:
-        logger.info("No saved albums found.")
+    if not first["total"]:
+        logger.info("No saved %s found.", kind)
         return
 
     # Confirm deletion with the user
-    confirmation = input(
-        f"You have {len(all_album_ids)} saved albums. Do you want to delete them all? (yes/no): "
+    confirmation = _confirm(
+        f"You have {first['total']} saved {kind}. Do you want to delete them all? (yes/no): ",
+        assume_yes,
     )
     if confirmation.lower() != "yes":
-        logger.info("Operation cancelled. No albums were deleted.")
+        logger.info("Operation cancelled. No %s were deleted.", kind)
         return
 
-    # Delete albums in chunks of 50 (Spotify API limit)
-    for i in range(0, len(all_album_ids), 50):
-        chunk = all_album_ids[i : i + 50]
-        sp.current_user_saved_albums_delete(albums=chunk)
-        logger.info("Deleted %d albums from saved albums.", len(chunk))
-
-    logger.info("All saved albums have been deleted.")
-
+    def delete_page(ids):
+        delete(ids)
+        logger.info("Deleted %d %s from saved %s.", len(ids), kind, kind)
+
+    # Pages of 50 (Spotify API limit) are deleted from the end of the
+    # collection while the pages before them are fetched, fetching and
+    # deleting share the jobs threads
+    page_jobs = max(1, jobs // 2)
+    run_pipelined(
+        (
+            functools.partial(delete_page, [item[key]["id"] for item in page["items"]])
+            for page in iter_pages(
+                fetch, limit=50, jobs=page_jobs, first=first, reverse=True
+            )
+            if page["items"]
+        ),
+        jobs=max(1, jobs - page_jobs),
+    )
 
-def delete_all_saved_shows(sp):
-    """Retrieve all saved shows for the user and delete them after confirmation."""
+    if cache is not None:
+        cache.invalidate_saved(kind)
+    logger.info("All saved %s have been deleted.", kind)
 
-    # Fetch all saved shows with pagination
-    saved_shows = sp.current_user_saved_shows(limit=50)
-    all_show_ids = [item["show"]["id"] for item in saved_shows["items"]]
 
-    while saved_shows["next"]:
-        saved_shows = sp.next(saved_shows)
-        all_show_ids.extend(item["show"]["id"] for item in saved_shows["items"])
+def delete_all_saved_tracks(sp, jobs=1, cache=None, assume_yes=False):
+    """Retrieve all saved tracks for the user and delete them after confirmation."""
+    _delete_saved_items(
+        sp,
+        "tracks",
+        lambda tracks: sp.current_user_saved_tracks_delete(tracks=tracks),
+        jobs=jobs,
+        cache=cache,
+        assume_yes=assume_yes,
+    )
 
-    if not all_show_ids:
-        logger.info("No saved shows found.")
-        return
 
-    # Confirm deletion with the user
-    confirmation = input(
-        f"You have {len(all_show_ids)} saved shows. Do you want to delete them all? (yes/no): "
+def delete_all_saved_albums(sp, jobs=1, cache=None, assume_yes=False):
+    """Retrieve all saved albums for the user and delete them after confirmation."""
+    _delete_saved_items(
+        sp,
+        "albums",
+        lambda albums: sp.current_user_saved_albums_delete(albums=albums),
+        jobs=jobs,
+        cache=cache,
+        assume_yes=assume_yes,
     )
-    if confirmation.lower() != "yes":
-        logger.info("Operation cancelled. No shows were deleted.")
-        return
 
-    # Delete shows in chunks of 50 (Spotify API limit)
-    for i in range(0, len(all_show_ids), 50):
-        chunk = all_show_ids[i : i + 50]
-        sp.current_user_saved_shows_delete(shows=chunk)
-        logger.info("Deleted %d shows from saved shows.", len(chunk))
 
-    logger.info("All saved shows have been deleted.")
+def delete_all_saved_shows(sp, jobs=1, cache=None, assume_yes=False):
+    """Retrieve all saved shows for the user and delete them after confirmation."""
+    _delete_saved_items(
+        sp,
+        "shows",
+        lambda shows: sp.current_user_saved_shows_delete(shows=shows),
+        jobs=jobs,
+        cache=cache,
+        assume_yes=assume_yes,
+    )
 
 
-def process_tracks(tracks):
-    result = []
-
+def _exported_tracks(tracks):
+    """Yield the track objects of a page of playlist items or saved tracks that are exported."""
     for item in tracks["items"]:
         track = item["track"]
 
@@ -177,318 +385,2138 @@ def process_tracks(tracks):
         if track.get("uri", str()).startswith("spotify:local"):
             # local files are not supported
             continue
-        artists = ";".join([artist["name"] for artist in track["artists"]])
-        result.append({"title": track["name"], "artists": artists, "uri": track["uri"]})
+        yield track
 
-    return result
 
+def process_tracks(tracks):
+    """Yield a records.Track for every track of a page of playlist items or saved tracks."""
+    for track in _exported_tracks(tracks):
+        artists = ";".join([artist["name"] for artist in track["artists"]])
+        yield records.make_track(track["name"], artists, track["uri"])
 
-def process_albums(albums):
-    result = []
 
+def process_albums(albums):
     for item in albums["items"]:
         album = item["album"]
 
         artists = ";".join([artist["name"] for artist in album["artists"]])
-        result.append({"title": album["name"], "artists": artists, "uri": album["uri"]})
-
-    return result
+        yield records.make_track(album["name"], artists, album["uri"])
 
 
 def process_shows(shows):
-    result = []
-
     for item in shows["items"]:
         show = item["show"]
-        result.append(
-            {"title": show["name"], "artists": show["publisher"], "uri": show["uri"]}
-        )
+        yield records.make_track(show["name"], show["publisher"], show["uri"])
+
 
-    return result
+def _playlist_path(dirname, name, pl_type):
+    if pl_type == "saved_tracks":
+        return f"{dirname}/{constants.FILEPATH_SAVED_TRACKS}"
+    return f"{dirname}/{name.replace('/', '_')}.xspf"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_template(source):
+    """Compile each template only once per process."""
+    env = jinja2.Environment(autoescape=True)
+    return env.from_string(source)
+
+
+def _render_to_file(path, source, content_hash=None, **context):
+    """Stream the rendered template to path, replacing it atomically.
+
+    With a content_hash (a records.ContentHash that the rendered items are
+    fed to), the template writes records.HASH_PLACEHOLDER into the header,
+    which is overwritten with the final digest before the file is moved into
+    place.
+    """
+    template = _get_template(source)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(
+                template.generate(
+                    content_hash=(
+                        records.HASH_PLACEHOLDER if content_hash is not None else None
+                    ),
+                    **context,
+                )
+            )
+        if content_hash is not None:
+            with open(tmp_path, "r+b") as f:
+                # titles are escaped, so the tag only occurs in the extension block
+                tag = f"<hash>{records.HASH_PLACEHOLDER}".encode("ascii")
+                offset = f.read(65536).index(tag) + len("<hash>")
+                f.seek(offset)
+                f.write(content_hash.hexdigest().encode("ascii"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
 def write_playlist(
     name, dirname, tracks, pl_type, location=None, public=False, collaborative=False
 ):
-    env = jinja2.Environment(autoescape=True)
-    template = env.from_string(constants.PLAYLIST_TEMPLATE)
-    content = template.render(
+    xspf_path = _playlist_path(dirname, name, pl_type)
+
+    content_hash = records.ContentHash()
+    _render_to_file(
+        xspf_path,
+        constants.PLAYLIST_TEMPLATE,
+        content_hash=content_hash,
         title=name,
         location=location,
-        tracklist=tracks,
+        tracklist=content_hash.feed(tracks),
         pl_type=pl_type,
         public=public,
         collaborative=collaborative,
     )
 
-    if pl_type == "saved_tracks":
-        xspf_path = f"{dirname}/{constants.FILEPATH_SAVED_TRACKS}"
-    else:
-        xspf_path = f"{dirname}/{name.replace('/', '_')}.xspf"
-
-    with open(xspf_path, "w", encoding="utf-8") as f:
-        f.write(content)
-
     logger.info('saved playlist "%s" to "%s"', name, xspf_path)
 
 
 def write_albums(dirname, albums):
-    env = jinja2.Environment(autoescape=True)
-    template = env.from_string(constants.ALBUM_TEMPLATE)
-    content = template.render(
-        albumlist=albums,
-    )
-
     xspf_path = f"{dirname}/{constants.FILEPATH_SAVED_ALBUMS}"
 
-    with open(xspf_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    _render_to_file(
+        xspf_path,
+        constants.ALBUM_TEMPLATE,
+        albumlist=albums,
+    )
 
     logger.info('saved albums to "%s"', xspf_path)
 
 
 def write_shows(dirname, shows):
-    env = jinja2.Environment(autoescape=True)
-    template = env.from_string(constants.SHOW_TEMPLATE)
-    content = template.render(
+    xspf_path = f"{dirname}/{constants.FILEPATH_SAVED_SHOWS}"
+
+    _render_to_file(
+        xspf_path,
+        constants.SHOW_TEMPLATE,
         showlist=shows,
     )
 
-    xspf_path = f"{dirname}/{constants.FILEPATH_SAVED_SHOWS}"
+    logger.info('saved shows to "%s"', xspf_path)
 
-    with open(xspf_path, "w", encoding="utf-8") as f:
-        f.write(content)
 
-    logger.info('saved shows to "%s"', xspf_path)
+def _export_playlist(sp, dirname, playlist, jobs=1, cache=None):
+    fetch = _playlist_items_fetch(
+        sp,
+        playlist["id"],
+        constants.FIELDS_PLAYLIST_TRACKS,
+        playlist["snapshot_id"],
+        cache,
+    )
+    pages = iter_pages(fetch, limit=100, jobs=jobs)
+    # the tracks are fetched while the file is written
+    tracks_processed = (track for tracks in pages for track in process_tracks(tracks))
+    write_playlist(
+        playlist["name"],
+        dirname,
+        tracks_processed,
+        pl_type="playlist",
+        location=playlist["uri"],
+        public=playlist["public"],
+        collaborative=playlist["collaborative"],
+    )
 
 
-def export_playlists(sp, username, dirname):
-    if not os.path.isdir(dirname):
-        os.mkdir(dirname)
+def _group_snapshots(playlists):
+    return {playlist["id"]: playlist["snapshot_id"] for playlist in playlists}
+
+
+def _export_playlist_group(
+    sp, dirname, path, playlists, jobs=1, cache=None, journal=None
+):
+    for playlist in playlists:
+        _export_playlist(sp, dirname, playlist, jobs=jobs, cache=cache)
+    if journal is not None:
+        journal.record(
+            ("playlist_exported", os.path.basename(path)), _group_snapshots(playlists)
+        )
+
 
-    playlists = sp.user_playlists(username, limit=50, offset=0)
-    playlist_items = playlists["items"]
-    while playlists["next"]:
-        playlists = sp.next(playlists)
+def _load_manifest(dirname):
+    try:
+        with open(
+            os.path.join(dirname, constants.FILEPATH_MANIFEST), encoding="utf-8"
+        ) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(dirname, manifest):
+    manifest_path = os.path.join(dirname, constants.FILEPATH_MANIFEST)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def _update_manifest(dirname, key, value):
+    manifest = _load_manifest(dirname)
+    manifest[key] = value
+    _save_manifest(dirname, manifest)
+
+
+def _read_xspf_records(xspf_path):
+    """Read the items of a previous export back into the format of process_*()."""
+    with XspfReader(xspf_path) as reader:
+        yield from reader.records()
+
+
+def _previous_saved_state(manifest, journal, key, xspf_path):
+    """State of the last export of a saved collection that is still on disk."""
+    if not os.path.isfile(xspf_path):
+        return None
+    if journal is not None and journal.get(("saved_exported", key)) is not None:
+        return journal.get(("saved_exported", key))
+    return manifest.get(key)
+
+
+def _fetch_saved_items(fetch, process, state, read_previous, jobs=1):
+    """Fetch a saved collection, reusing the previous export where possible.
+
+    Saved items are returned newest first, so paging can stop at the first
+    item that is not newer than the newest one of the last export. If the
+    totals don't add up (something was removed) everything is fetched again.
+
+    Returns an iterable of the processed items, or None if nothing changed,
+    and the new manifest state.
+    """
+    first = fetch(limit=50, offset=0)
+    new_state = {
+        "total": first["total"],
+        "added_at": first["items"][0]["added_at"] if first["items"] else None,
+    }
+
+    if state is not None:
+        if state == new_state:
+            return None, new_state
+
+        newest = state["added_at"] or ""
+        new_items = []
+        page = first
+        offset = 0
+        while page["items"]:
+            new_on_page = [item for item in page["items"] if item["added_at"] > newest]
+            new_items.extend(new_on_page)
+            if len(new_on_page) < len(page["items"]):
+                break
+            offset += 50
+            page = fetch(limit=50, offset=offset)
+
+        if state["total"] + len(new_items) == new_state["total"]:
+            # the previous file is streamed into the new one, which is only
+            # moved into its place once it has been written completely
+            return (
+                itertools.chain(process({"items": new_items}), read_previous()),
+                new_state,
+            )
+        logger.info("saved items were removed since the last export, fetching all")
+
+    pages = iter_pages(fetch, limit=50, jobs=jobs, first=first)
+    return (item for page in pages for item in process(page)), new_state
+
+
+def _fetch_playlists(sp, username, jobs=1, cache=None):
+    playlist_items = []
+    for playlists in iter_pages(
+        _playlists_fetch(sp, username, cache), limit=50, jobs=jobs
+    ):
         playlist_items.extend(playlists["items"])
+    return playlist_items
+
+
+def _playlist_groups(dirname, playlists):
+    """Group playlists by the file they are exported to.
+
+    Returns the groups by path and the manifest entries of the playlists.
+    """
+    # Playlists that end up in the same file are exported one after another,
+    # so the last one wins exactly like in the serial path.
+    groups = {}
+    current = {}
+    for playlist in playlists:
+        path = _playlist_path(dirname, playlist["name"], "playlist")
+        groups.setdefault(path, []).append(playlist)
+        current[playlist["id"]] = {
+            "snapshot_id": playlist["snapshot_id"],
+            "path": os.path.basename(path),
+        }
+    return groups, current
+
+
+def export_playlists(
+    sp,
+    username,
+    dirname,
+    jobs=1,
+    full=False,
+    cache=None,
+    journal=None,
+    playlists=None,
+):
+    """Export the playlists that changed since the last export, and saved tracks.
 
-    for playlist in playlist_items:
-        tracks = sp.playlist_items(
-            playlist["id"],
-            fields="items(track(name,artists(name),uri)),next",
+    ``playlists`` can be the user's playlists if they have just been fetched.
+    """
+    if not os.path.isdir(dirname):
+        os.mkdir(dirname)
+
+    manifest = {} if full else _load_manifest(dirname)
+
+    if playlists is None:
+        playlists = _fetch_playlists(sp, username, jobs, cache)
+    groups, current = _playlist_groups(dirname, playlists)
+
+    # A file only needs to be written again if any playlist that maps to it
+    # has a new snapshot_id, or if the set of those playlists changed.
+    previous = manifest.get("playlists", {})
+    previous_by_path = {}
+    for playlist_id, entry in previous.items():
+        previous_by_path.setdefault(entry["path"], set()).add(playlist_id)
+
+    changed_groups = []
+    for path, group in groups.items():
+        unchanged = (
+            os.path.isfile(path)
+            and previous_by_path.get(os.path.basename(path))
+            == {playlist["id"] for playlist in group}
+            and all(
+                previous[playlist["id"]] == current[playlist["id"]]
+                for playlist in group
+            )
+        )
+        # or if a previous run that was interrupted has already written it
+        if not unchanged and journal is not None:
+            unchanged = os.path.isfile(path) and journal.get(
+                ("playlist_exported", os.path.basename(path))
+            ) == _group_snapshots(group)
+        if not unchanged:
+            changed_groups.append((path, group))
+
+    if len(changed_groups) < len(groups):
+        logger.info(
+            "skipped %d playlists unchanged since the last export",
+            sum(len(group) for group in groups.values())
+            - sum(len(group) for _, group in changed_groups),
         )
-        tracks_processed = process_tracks(tracks)
-        while tracks["next"]:
-            tracks = sp.next(tracks)
-            tracks_processed.extend(process_tracks(tracks))
+
+    workers, page_jobs = split_jobs(jobs, len(changed_groups))
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _export_playlist_group,
+                    sp,
+                    dirname,
+                    path,
+                    group,
+                    page_jobs,
+                    cache,
+                    journal,
+                )
+                for path, group in changed_groups
+            ]
+            for future in futures:
+                future.result()
+    else:
+        for path, group in changed_groups:
+            _export_playlist_group(
+                sp, dirname, path, group, page_jobs, cache=cache, journal=journal
+            )
+
+    _update_manifest(dirname, "playlists", current)
+
+    xspf_path = _playlist_path(dirname, "Saved tracks", "saved_tracks")
+    tracks_processed, state = _fetch_saved_items(
+        _saved_fetch(sp, "tracks", cache),
+        process_tracks,
+        _previous_saved_state(manifest, journal, "saved_tracks", xspf_path),
+        lambda: _read_xspf_records(xspf_path),
+        jobs=jobs,
+    )
+    if tracks_processed is None:
+        logger.info("saved tracks unchanged since the last export")
+    else:
         write_playlist(
-            playlist["name"],
-            dirname,
-            tracks_processed,
-            pl_type="playlist",
-            location=playlist["uri"],
-            public=playlist["public"],
-            collaborative=playlist["collaborative"],
+            "Saved tracks", dirname, tracks_processed, pl_type="saved_tracks"
         )
+    _update_manifest(dirname, "saved_tracks", state)
+    if journal is not None:
+        journal.record(("saved_exported", "saved_tracks"), state)
+
+
+def export_albums(sp, filename, jobs=1, full=False, cache=None, journal=None):
+    manifest = {} if full else _load_manifest(filename)
+    xspf_path = f"{filename}/{constants.FILEPATH_SAVED_ALBUMS}"
+
+    # Fetch the saved albums added since the last export, or all of them
+    albums_processed, state = _fetch_saved_items(
+        _saved_fetch(sp, "albums", cache),
+        process_albums,
+        _previous_saved_state(manifest, journal, "saved_albums", xspf_path),
+        lambda: _read_xspf_records(xspf_path),
+        jobs=jobs,
+    )
+    if albums_processed is None:
+        logger.info("saved albums unchanged since the last export")
+    else:
+        write_albums(
+            filename,
+            albums_processed,
+        )
+    _update_manifest(filename, "saved_albums", state)
+    if journal is not None:
+        journal.record(("saved_exported", "saved_albums"), state)
+
+
+def export_shows(sp, filename, jobs=1, full=False, cache=None, journal=None):
+    manifest = {} if full else _load_manifest(filename)
+    xspf_path = f"{filename}/{constants.FILEPATH_SAVED_SHOWS}"
+
+    # Fetch the saved shows added since the last export, or all of them
+    shows_processed, state = _fetch_saved_items(
+        _saved_fetch(sp, "shows", cache),
+        process_shows,
+        _previous_saved_state(manifest, journal, "saved_shows", xspf_path),
+        lambda: _read_xspf_records(xspf_path),
+        jobs=jobs,
+    )
+    if shows_processed is None:
+        logger.info("saved shows unchanged since the last export")
+    else:
+        write_shows(
+            filename,
+            shows_processed,
+        )
+    _update_manifest(filename, "saved_shows", state)
+    if journal is not None:
+        journal.record(("saved_exported", "saved_shows"), state)
 
-    tracks = sp.current_user_saved_tracks()
-    tracks_processed = process_tracks(tracks)
-    while tracks["next"]:
-        tracks = sp.next(tracks)
-        tracks_processed.extend(process_tracks(tracks))
-    write_playlist("Saved tracks", dirname, tracks_processed, pl_type="saved_tracks")
 
+def export_bundle(sp, username, dirname, jobs=1, full=False, cache=None):
+    """Export playlists and saved collections into one library bundle.
 
-def export_albums(sp, filename):
-    saved_albums = sp.current_user_saved_albums(limit=50)
-    albums_processed = process_albums(saved_albums)
+    Like the XSPF export this is incremental: playlists with an unchanged
+    snapshot_id and the saved items of the last export are taken from the
+    previous bundle instead of being fetched again.
+    """
+    if not os.path.isdir(dirname):
+        os.mkdir(dirname)
 
-    # Use pagination to fetch all saved albums
-    while saved_albums["next"]:
-        saved_albums = sp.next(saved_albums)
-        albums_processed.extend(process_albums(saved_albums))
+    bundle_path = f"{dirname}/{constants.FILEPATH_BUNDLE}"
+    manifest = {} if full else _load_manifest(dirname)
+    state = manifest.get("bundle", {}) if os.path.isfile(bundle_path) else {}
+
+    # collections of the previous bundle by playlist uri or saved type
+    previous = {}
+    if state:
+        with bundle.BundleReader(bundle_path) as reader:
+            for collection in reader:
+                previous[collection.location or collection.pl_type] = collection
+
+    playlists = []
+    for page in iter_pages(_playlists_fetch(sp, username, cache), limit=50, jobs=jobs):
+        playlists.extend(page["items"])
+    snapshots = {playlist["id"]: playlist["snapshot_id"] for playlist in playlists}
+    workers, page_jobs = split_jobs(jobs, len(playlists))
+
+    def fetch_tracks(playlist):
+        if (
+            state.get("playlists", {}).get(playlist["id"]) == playlist["snapshot_id"]
+            and playlist["uri"] in previous
+        ):
+            return previous[playlist["uri"]].records()
+        fetch = _playlist_items_fetch(
+            sp,
+            playlist["id"],
+            constants.FIELDS_PLAYLIST_TRACKS,
+            playlist["snapshot_id"],
+            cache,
+        )
+        return [
+            track
+            for page in iter_pages(fetch, limit=100, jobs=page_jobs)
+            for track in process_tracks(page)
+        ]
+
+    new_state = {"playlists": snapshots}
+    with bundle.BundleWriter(bundle_path) as writer:
+        # playlists are fetched on up to workers threads and written in order
+        for playlist, tracks in zip(
+            playlists, map_pipelined(fetch_tracks, playlists, jobs=workers)
+        ):
+            writer.add(
+                playlist["name"],
+                "playlist",
+                tracks,
+                location=playlist["uri"],
+                public=playlist["public"],
+                collaborative=playlist["collaborative"],
+            )
 
-    write_albums(
-        filename,
-        albums_processed,
+        for kind, process, name in (
+            ("tracks", process_tracks, "Saved tracks"),
+            ("albums", process_albums, "Saved albums"),
+            ("shows", process_shows, "Saved shows"),
+        ):
+            pl_type = f"saved_{kind}"
+            items, new_state[pl_type] = _fetch_saved_items(
+                _saved_fetch(sp, kind, cache),
+                process,
+                state.get(pl_type) if pl_type in previous else None,
+                previous[pl_type].records if pl_type in previous else None,
+                jobs=jobs,
+            )
+            if items is None:
+                logger.info("saved %s unchanged since the last export", kind)
+                items = previous[pl_type].records()
+            writer.add(name, pl_type, items)
+
+    _update_manifest(dirname, "bundle", new_state)
+    logger.info(
+        'saved %d playlists and saved items to "%s"', len(playlists), bundle_path
     )
 
 
-def export_shows(sp, filename):
-    saved_shows = sp.current_user_saved_shows(limit=50)
-    shows_processed = process_shows(saved_shows)
+class PlaylistCatalog:
+    """In-process index of the user's playlists, keyed by name and by id.
 
-    # Use pagination to fetch all saved shows
-    while saved_shows["next"]:
-        saved_shows = sp.next(saved_shows)
-        shows_processed.extend(process_shows(saved_shows))
+    The playlist list is fetched once and then kept up to date as playlists
+    are created, so looking up a name no longer pages through the whole
+    account for every imported file.
+    """
 
-    write_shows(
-        filename,
-        shows_processed,
-    )
+    def __init__(self, sp, username, jobs=1, cache=None):
+        self.sp = sp
+        self.username = username
+        self.cache = cache
+        self.by_id = {}
+        self.by_name = {}
+
+        for playlists in iter_pages(
+            _playlists_fetch(sp, username, cache), limit=50, jobs=jobs
+        ):
+            for playlist in playlists["items"]:
+                self.add(playlist)
+
+    def add(self, playlist):
+        self.by_id[playlist["id"]] = playlist
+        # keep the first playlist with a given name, like the old linear search did
+        self.by_name.setdefault(playlist["name"], playlist)
+
+    def get_id(self, playlist_name):
+        """Return the ID of an existing playlist with the given name, or None if it doesn't exist."""
+        playlist = self.by_name.get(playlist_name)
+        return playlist["id"] if playlist is not None else None
+
+    def create(self, playlist_name, public=False):
+        playlist = self.sp.user_playlist_create(
+            self.username, playlist_name, public=public
+        )
+        self.add(playlist)
+        self.changed()
+        return playlist["id"]
+
+    def changed(self):
+        """Note that a playlist was created or modified."""
+        if self.cache is not None:
+            self.cache.invalidate_playlists()
+
+    def modified(self, playlist_id, snapshot_id):
+        """Note that the items of a playlist changed to the version snapshot_id.
 
+        Later lookups of its items then don't use entries cached for the old
+        snapshot_id, and edits by position refer to the new one.
+        """
+        self.by_id[playlist_id]["snapshot_id"] = snapshot_id
+        self.changed()
 
-def _get_existing_playlist_id(sp, username, playlist_name):
+
+def _get_existing_playlist_id(sp, username, playlist_name, catalog=None):
     """Return the ID of an existing playlist with the given name, or None if it doesn't exist."""
-    playlists = sp.user_playlists(username)
-    playlist_items = playlists["items"]
+    if catalog is None:
+        catalog = PlaylistCatalog(sp, username)
+    return catalog.get_id(playlist_name)
+
+
+class XspfReader:
+    """Streaming reader for the files written by write_playlist/albums/shows.
+
+    The header (title, location and the settings in our extension block) is
+    read when the reader is created. The entries of the track, album or show
+    list are then parsed one at a time with iterparse and cleared right after,
+    so the document is never held in memory as a tree.
+    """
+
+    NS = "{http://xspf.org/ns/0/}"
+    EXTENSION = "https://github.com/debfx/spotify-playlists"
+    LISTS = {f"{NS}trackList", f"{NS}albumList", f"{NS}showList"}
+    ITEMS = {f"{NS}track", f"{NS}album", f"{NS}show"}
+
+    def __init__(self, path):
+        self.path = path
+        self.title = None
+        self.location = None
+        self.public = False
+        self.collaborative = False
+        self.pl_type = None
+        self.content_hash = None
+        self._file = open(path, "rb")
+        self._events = xml.etree.ElementTree.iterparse(
+            self._file, events=("start", "end")
+        )
+        self._list = None
+        try:
+            self._read_header()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _read_header(self):
+        depth = 0
+        for event, elem in self._events:
+            if event == "start":
+                depth += 1
+                if depth == 2 and elem.tag in self.LISTS:
+                    self._list = elem
+                    return
+                continue
 
-    # Use Spotipy's built-in paginator to fetch all playlists
-    while playlists["next"]:
-        playlists = sp.next(playlists)
-        playlist_items.extend(playlists["items"])
+            depth -= 1
+            if depth != 1:
+                continue
+            if elem.tag == f"{self.NS}title":
+                self.title = elem.text
+            elif elem.tag == f"{self.NS}location":
+                self.location = elem.text
+            elif (
+                elem.tag == f"{self.NS}extension"
+                and elem.get("application") == self.EXTENSION
+            ):
+                public = elem.findtext(f"{self.NS}public")
+                if public is not None:
+                    self.public = public.lower() == "true"
+                collaborative = elem.findtext(f"{self.NS}collaborative")
+                if collaborative is not None:
+                    self.collaborative = collaborative.lower() == "true"
+                self.pl_type = elem.findtext(f"{self.NS}type")
+                self.content_hash = elem.findtext(f"{self.NS}hash")
+
+    def records(self):
+        """Yield the entries in the format of process_tracks() and friends."""
+        if self._list is None:
+            return
+        for event, elem in self._events:
+            if event == "end" and elem.tag in self.ITEMS:
+                artists = elem.find(f"{self.NS}creator")
+                if artists is None:
+                    artists = elem.find(f"{self.NS}publisher")
+                yield records.make_track(
+                    elem.findtext(f"{self.NS}title"),
+                    artists.text if artists is not None else None,
+                    elem.findtext(f"{self.NS}location"),
+                )
+                self._list.clear()
+            elif event == "end" and elem is self._list:
+                break
 
-    # Search for a playlist with the given name
-    for playlist in playlist_items:
-        if playlist["name"] == playlist_name:
-            return playlist["id"]
+    def locations(self):
+        for record in self.records():
+            yield record.uri
 
-    return None
+    def batches(self, n):
+        """Yield the locations in lists of n, parsed on a background thread."""
+        return iter_in_background(batched(self.locations(), n))
 
 
-def _get_playlist_track_uris(sp, playlist_id):
+class ParsedPlaylist:
+    """The header and track URIs of a playlist file, with the interface of XspfReader.
+
+    Created by _parse_playlist_file() in a worker process and sent back to
+    the importing process, so it only holds what importing needs.
+    """
+
+    def __init__(self, path, title, location, public, collaborative, pl_type, uris):
+        self.path = path
+        self.title = title
+        self.location = location
+        self.public = public
+        self.collaborative = collaborative
+        self.pl_type = pl_type
+        self.uris = uris
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __len__(self):
+        return len(self.uris)
+
+    def locations(self):
+        return iter(self.uris)
+
+    def batches(self, n):
+        return chunks(self.uris, n)
+
+
+def _parse_playlist_file(path):
+    with XspfReader(path) as reader:
+        return ParsedPlaylist(
+            path,
+            reader.title,
+            reader.location,
+            reader.public,
+            reader.collaborative,
+            reader.pl_type,
+            tuple(reader.locations()),
+        )
+
+
+def _get_playlist_track_uris(sp, playlist_id, jobs=1, cache=None, snapshot_id=None):
     """Retrieve all track URIs currently in the specified playlist."""
     track_uris = set()
-    results = sp.playlist_tracks(playlist_id)
-    while results:
+    fetch = _playlist_items_fetch(
+        sp, playlist_id, constants.FIELDS_PLAYLIST_URIS, snapshot_id, cache
+    )
+    for results in iter_pages(fetch, limit=100, jobs=jobs):
         for item in results["items"]:
-            track_uris.add(item["track"]["uri"])
-        results = sp.next(results) if results["next"] else None
+            if item["track"] is not None:
+                track_uris.add(item["track"]["uri"])
     return track_uris
 
 
-def import_playlist(sp, username, filename):
-    def _import_playlist_from_file(sp, username, filename):
-        tree = xml.etree.ElementTree.parse(filename)
-        root = tree.getroot()
+def _add_playlist_tracks(sp, username, playlist_id, name, tracks):
+    """Add tracks to a playlist, returns its new snapshot_id (None if none were added)."""
+    snapshot_id = None
+    if tracks:
+        result = sp.user_playlist_add_tracks(username, playlist_id, tracks)
+        snapshot_id = result["snapshot_id"]
+    logger.info('Added %d new tracks to playlist "%s"', len(tracks), name)
+    return snapshot_id
 
-        name = root.find("{http://xspf.org/ns/0/}title").text
-        tracks = []
-        public = False
-        collaborative = False
 
-        for elem in root.findall(
-            "{http://xspf.org/ns/0/}trackList/{http://xspf.org/ns/0/}track"
-        ):
-            location = elem.find("{http://xspf.org/ns/0/}location").text
-            tracks.append(location)
-
-        elem_extension = root.find(
-            "{http://xspf.org/ns/0/}extension[@application='https://github.com/debfx/spotify-playlists']"
+def _import_playlist_from_reader(
+    sp, username, reader, catalog, jobs=1, journal=None, validator=None
+):
+    name = reader.title
+    file_key = os.path.basename(reader.path)
+
+    # batches of 100 tracks of the file up to this one were added by a
+    # previous run, and maybe the playlist was created by it
+    done_through = -1
+    playlist_id = None
+    if journal is not None:
+        done_through = journal.get(("playlist_tracks", file_key), -1)
+        playlist_id = journal.get(("playlist_created", file_key))
+        if playlist_id not in catalog.by_id:
+            playlist_id = None
+
+    if playlist_id is None:
+        # Check for an existing playlist with the same name
+        playlist_id = _get_existing_playlist_id(sp, username, name, catalog)
+    if playlist_id is None:
+        # Create a new playlist if no existing playlist is found
+        playlist_id = catalog.create(name, public=reader.public)
+        logger.info('Created new playlist "%s"', name)
+        if journal is not None:
+            journal.record(("playlist_created", file_key), playlist_id)
+        # nothing to fetch from a playlist we just created
+        existing_track_uris = set()
+    else:
+        logger.info('Using existing playlist "%s"', name)
+        # Get current track URIs in the playlist. This is also needed when
+        # resuming: adds after the last journal sync may have gone through.
+        existing_track_uris = _get_playlist_track_uris(
+            sp,
+            playlist_id,
+            jobs=jobs,
+            cache=catalog.cache,
+            snapshot_id=catalog.by_id[playlist_id].get("snapshot_id"),
         )
-        if elem_extension is not None:
-            elem_public = elem_extension.find("{http://xspf.org/ns/0/}public")
-            if elem_public is not None:
-                public = elem_public.text.lower() == "true"
 
-            elem_collaborative = elem_extension.find(
-                "{http://xspf.org/ns/0/}collaborative"
+    # Set collaborative setting if needed
+    if reader.collaborative:
+        sp.user_playlist_change_details(
+            username, playlist_id, collaborative=reader.collaborative
+        )
+        catalog.changed()
+
+    # Add only new tracks, in chunks of 100 (Spotify API limit), while the
+    # rest of the file is parsed
+    new_tracks = []
+    # the batch of the file every pending track came from
+    new_batches = []
+    added = 0
+    snapshot_id = None
+    for n, tracks in enumerate(reader.batches(100)):
+        if n <= done_through:
+            continue
+        valid = None
+        if validator is not None:
+            valid = validator.valid(
+                track for track in tracks if track not in existing_track_uris
             )
-            if elem_collaborative is not None:
-                collaborative = elem_collaborative.text.lower() == "true"
-
-        # Check for an existing playlist with the same name
-        playlist_id = _get_existing_playlist_id(sp, username, name)
-        if playlist_id is None:
-            # Create a new playlist if no existing playlist is found
-            playlist_id = sp.user_playlist_create(username, name, public=public)["id"]
-            logger.info('Created new playlist "%s"', name)
-        else:
-            logger.info('Using existing playlist "%s"', name)
-
-        # Set collaborative setting if needed
-        if collaborative:
-            sp.user_playlist_change_details(
-                username, playlist_id, collaborative=collaborative
+        for track in tracks:
+            if track in existing_track_uris:
+                continue
+            if valid is not None and track not in valid:
+                logger.warning('Skipped invalid track %s of playlist "%s"', track, name)
+                continue
+            new_tracks.append(track)
+            new_batches.append(n)
+        while len(new_tracks) >= 100:
+            snapshot_id = _add_playlist_tracks(
+                sp, username, playlist_id, name, new_tracks[:100]
             )
+            added += 100
+            del new_tracks[:100]
+            del new_batches[:100]
+        # every batch before the first pending track is done
+        complete = new_batches[0] - 1 if new_batches else n
+        if journal is not None and complete > done_through:
+            journal.record(("playlist_tracks", file_key), complete)
+            done_through = complete
+    if new_tracks or not added:
+        snapshot_id = (
+            _add_playlist_tracks(sp, username, playlist_id, name, new_tracks)
+            or snapshot_id
+        )
+    if new_tracks or added:
+        catalog.modified(playlist_id, snapshot_id)
 
-        # Get current track URIs in the playlist
-        existing_track_uris = _get_playlist_track_uris(sp, playlist_id)
+    if journal is not None:
+        journal.record(("playlist_imported", file_key))
+    logger.info('Imported playlist "%s" from "%s"', name, reader.path)
 
-        # Filter tracks to add only new ones
-        new_tracks = [track for track in tracks if track not in existing_track_uris]
 
-        if len(new_tracks) > 0:
-            # Add new tracks in chunks of 100 (Spotify API limit)
-            for tracks_chunk in chunks(new_tracks, 100):
-                sp.user_playlist_add_tracks(username, playlist_id, tracks_chunk)
-                logger.info(
-                    'Added %d new tracks to playlist "%s"', len(tracks_chunk), name
-                )
-        else:
-            logger.info('Added %d new tracks to playlist "%s"', 0, name)
+def _is_bundle(filename):
+    return os.path.isfile(filename) and filename.endswith(".jsonl.gz")
+
 
-        logger.info('Imported playlist "%s" from "%s"', name, filename)
+def _playlist_readers(filename, processes=None, skip=None):
+    """Yield a reader for every playlist of a directory, .xspf file or bundle.
 
+    .xspf files are streamed by an XspfReader that is closed once the next
+    reader is requested. With processes they are instead parsed completely
+    into ParsedPlaylist objects, ahead on a pool of that many processes (or in
+    this one for 1). Files are taken in the sorted order of their paths, those
+    for which skip(path) is true are left out without being parsed.
+    """
+    bundle_path = None
     # Process all .xspf files in the given directory or file
     if os.path.isdir(filename):
         # Iterate over all .xspf files in the directory
-        for file_path in glob.glob(os.path.join(filename, "*.xspf")):
+        xspf_paths = sorted(
+            file_path
+            for file_path in glob.glob(os.path.join(filename, "*.xspf"))
             # these are handled separately. skip them
-            if os.path.basename(file_path) in [
+            if os.path.basename(file_path)
+            not in [
                 constants.FILEPATH_SAVED_TRACKS,
                 constants.FILEPATH_SAVED_SHOWS,
                 constants.FILEPATH_SAVED_ALBUMS,
-            ]:
-                continue
-            _import_playlist_from_file(sp, username, file_path)
+            ]
+        )
+        bundle_path = os.path.join(filename, constants.FILEPATH_BUNDLE)
     elif os.path.isfile(filename) and filename.endswith(".xspf"):
         # If filename is a single .xspf file, process it directly
-        _import_playlist_from_file(sp, username, filename)
+        xspf_paths = [filename]
+    elif _is_bundle(filename):
+        xspf_paths = []
+        bundle_path = filename
     else:
-        logger.error("The provided filename is neither a directory nor a .xspf file.")
+        logger.error(
+            "The provided filename is neither a directory nor a .xspf or bundle file."
+        )
+        return
 
+    if skip is not None:
+        xspf_paths = [path for path in xspf_paths if not skip(path)]
+    if processes is None:
+        for file_path in xspf_paths:
+            with XspfReader(file_path) as reader:
+                yield reader
+    else:
+        yield from map_pipelined(
+            _parse_playlist_file,
+            xspf_paths,
+            jobs=min(processes, len(xspf_paths)),
+            executor_class=concurrent.futures.ProcessPoolExecutor,
+        )
+    if bundle_path is not None and os.path.isfile(bundle_path):
+        with bundle.BundleReader(bundle_path) as reader:
+            for collection in reader:
+                if collection.pl_type == "playlist" and not (
+                    skip is not None and skip(collection.path)
+                ):
+                    yield collection
+
+
+def _open_collection(xspf_path, pl_type):
+    """Open a saved collection, from its .xspf file or from the bundle."""
+    dirname = os.path.dirname(xspf_path)
+    bundle_path = (
+        dirname
+        if _is_bundle(dirname)
+        else os.path.join(dirname, constants.FILEPATH_BUNDLE)
+    )
+    if not os.path.isfile(xspf_path) and os.path.isfile(bundle_path):
+        collection = bundle.read_collection(bundle_path, pl_type)
+        if collection is not None:
+            return collection
+    return XspfReader(xspf_path)
+
+
+def import_playlist(
+    sp,
+    username,
+    filename,
+    jobs=1,
+    cache=None,
+    journal=None,
+    processes=1,
+    validator=None,
+):
+    """Import a playlist file, or all playlists of a directory or bundle.
+
+    Files are parsed on up to processes worker processes while up to jobs
+    playlists are imported at the same time. Files with the same playlist
+    name are imported one after another in the order of their paths, so the
+    result doesn't depend on which file was parsed first. With a validator
+    (a uri_validation.UriValidator) invalid tracks are left out.
+    """
+    # fetched once and shared by all files of this run
+    catalog = PlaylistCatalog(sp, username, jobs=jobs, cache=cache)
+    # a directory or bundle imports many files at the same time
+    single_file = os.path.isfile(filename) and not _is_bundle(filename)
+    _, page_jobs = split_jobs(jobs, 1 if single_file else jobs)
+
+    def imported_before(path):
+        if journal is not None and journal.get(
+            ("playlist_imported", os.path.basename(path))
+        ):
+            logger.info('Skipping "%s", imported before', path)
+            return True
+        return False
+
+    def in_name_order(readers):
+        # every reader waits for the previous one with the same name
+        previous = {}
+        for reader in readers:
+            done = threading.Event()
+            yield reader, previous.get(reader.title), done
+            previous[reader.title] = done
+
+    def import_one(task):
+        reader, previous, done = task
+        try:
+            if previous is not None:
+                previous.wait()
+            _import_playlist_from_reader(
+                sp,
+                username,
+                reader,
+                catalog,
+                jobs=page_jobs,
+                journal=journal,
+                validator=validator,
+            )
+        finally:
+            done.set()
+
+    if jobs == 1 and processes == 1:
+        # one file at a time, streamed while it is imported
+        processes = None
+    # otherwise imports run on other threads while the next file is opened,
+    # so files are parsed completely first
+    readers = _playlist_readers(filename, processes=processes, skip=imported_before)
+    # an import that started later never runs before an earlier one, so
+    # waiting for the previous reader of the same name can't deadlock
+    for _ in map_pipelined(import_one, in_name_order(readers), jobs=jobs):
+        pass
+
+
+def _plan_playlist_edits(current, target):
+    """Plan the requests that turn the track list current into target.
+
+    Tracks that are in both lists in the same relative order (found with
+    difflib) are kept. Of the others, a track that is removed in one place
+    and inserted in another is moved instead, everything else is removed or
+    inserted. Returns a list of operations to apply in order:
+
+    * ("remove", [{"uri": ..., "positions": [...]}, ...]), up to 100 positions,
+      from the end of the playlist so earlier positions stay valid
+    * ("move", range_start, range_length, insert_before)
+    * ("insert", position, uris), up to 100 uris
+    * ("replace", uris) followed by inserts, if rewriting the whole playlist
+      needs fewer requests
+    """
+    rewrite = [("replace", target[:100])] + [
+        ("insert", position, target[position : position + 100])
+        for position in range(100, len(target), 100)
+    ]
+
+    matcher = difflib.SequenceMatcher(None, current, target, autojunk=False)
+    # index in current of the track at every kept position of target
+    matched = {}
+    removed = collections.defaultdict(collections.deque)
+    inserted = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            matched.update(zip(range(j1, j2), range(i1, i2)))
+            continue
+        for i in range(i1, i2):
+            removed[current[i]].append(i)
+        inserted.extend(range(j1, j2))
+
+    # a track removed here and inserted there is a move
+    new = []
+    for j in inserted:
+        if removed[target[j]]:
+            matched[j] = removed[target[j]].popleft()
+        else:
+            new.append(j)
 
-def import_saved_tracks(sp, filename):
-    tree = xml.etree.ElementTree.parse(f"{filename}/{constants.FILEPATH_SAVED_TRACKS}")
-    root = tree.getroot()
+    operations = []
+    removals = sorted(
+        (i for positions in removed.values() for i in positions), reverse=True
+    )
+    for batch in chunks(removals, 100):
+        by_uri = {}
+        for i in batch:
+            by_uri.setdefault(current[i], []).append(i)
+        operations.append(
+            (
+                "remove",
+                [
+                    {"uri": uri, "positions": positions}
+                    for uri, positions in by_uri.items()
+                ],
+            )
+        )
 
-    tracks = []
+    # Bring the remaining tracks into the order of target, moving the longest
+    # run of tracks that belongs at the first wrong position.
+    order = sorted(set(range(len(current))) - set(removals))
+    wanted = [matched[j] for j in range(len(target)) if j in matched]
+    for k in range(len(wanted)):
+        if order[k] == wanted[k]:
+            continue
+        start = order.index(wanted[k], k)
+        length = 1
+        while (
+            start + length < len(order)
+            and k + length < len(wanted)
+            and order[start + length] == wanted[k + length]
+        ):
+            length += 1
+        operations.append(("move", start, length, k))
+        order[k:k] = order[start : start + length]
+        del order[start + length : start + 2 * length]
+        if len(operations) > len(rewrite):
+            return rewrite
+
+    # new tracks in runs of consecutive positions, from the start of target
+    for _, run in itertools.groupby(enumerate(new), lambda pair: pair[1] - pair[0]):
+        run = [j for _, j in run]
+        for batch in chunks(run, 100):
+            operations.append(("insert", batch[0], [target[j] for j in batch]))
+
+    return operations if len(operations) <= len(rewrite) else rewrite
+
+
+def _apply_playlist_edits(sp, playlist_id, snapshot_id, operations):
+    """Apply the operations of _plan_playlist_edits(), returns the new snapshot_id."""
+    for operation in operations:
+        if operation[0] == "remove":
+            result = sp.playlist_remove_specific_occurrences_of_items(
+                playlist_id, operation[1], snapshot_id=snapshot_id
+            )
+        elif operation[0] == "move":
+            _, start, length, before = operation
+            result = sp.playlist_reorder_items(
+                playlist_id,
+                range_start=start,
+                insert_before=before,
+                range_length=length,
+                snapshot_id=snapshot_id,
+            )
+        elif operation[0] == "insert":
+            result = sp.playlist_add_items(
+                playlist_id, operation[2], position=operation[1]
+            )
+        else:
+            result = sp.playlist_replace_items(playlist_id, operation[1])
+        snapshot_id = result["snapshot_id"]
+    return snapshot_id
 
-    for elem in root.findall(
-        "{http://xspf.org/ns/0/}trackList/{http://xspf.org/ns/0/}track"
-    ):
-        location = elem.find("{http://xspf.org/ns/0/}location").text
-        tracks.append(location)
 
-    for tracks_chunk in chunks(tracks, 50):
-        sp.current_user_saved_tracks_add(tracks=tracks_chunk)
-        logger.info("Added %d new tracks to saved tracks", len(tracks_chunk))
+def _sync_playlist_from_reader(sp, username, reader, catalog, jobs=1):
+    name = reader.title
+    playlist_id = _get_existing_playlist_id(sp, username, name, catalog)
+    if playlist_id is None:
+        # a new playlist just needs all the tracks added
+        _import_playlist_from_reader(sp, username, reader, catalog, jobs=jobs)
+        return
 
+    snapshot_id = catalog.by_id[playlist_id].get("snapshot_id")
+    fetch = _playlist_items_fetch(
+        sp, playlist_id, constants.FIELDS_PLAYLIST_URIS, snapshot_id, catalog.cache
+    )
+    current = [
+        item["track"]["uri"] if item["track"] is not None else None
+        for page in iter_pages(fetch, limit=100, jobs=jobs)
+        for item in page["items"]
+    ]
+    if any(uri is None or uri.startswith("spotify:local") for uri in current):
+        # unavailable tracks have no uri to address them by, and local files
+        # are never exported, so the diff would remove all of them
+        logger.warning(
+            'Playlist "%s" contains unavailable tracks or local files, only adding new tracks',
+            name,
+        )
+        _import_playlist_from_reader(sp, username, reader, catalog, jobs=jobs)
+        return
 
-def import_albums(sp, filename):
-    tree = xml.etree.ElementTree.parse(f"{filename}/{constants.FILEPATH_SAVED_ALBUMS}")
-    root = tree.getroot()
+    if reader.collaborative:
+        sp.user_playlist_change_details(
+            username, playlist_id, collaborative=reader.collaborative
+        )
+        catalog.changed()
+
+    operations = _plan_playlist_edits(current, list(reader.locations()))
+    if operations:
+        snapshot_id = _apply_playlist_edits(sp, playlist_id, snapshot_id, operations)
+        catalog.modified(playlist_id, snapshot_id)
+    logger.info(
+        'Synced playlist "%s" from "%s" with %d changes',
+        name,
+        reader.path,
+        len(operations),
+    )
 
-    albums = []
 
-    for elem in root.findall(
-        "{http://xspf.org/ns/0/}albumList/{http://xspf.org/ns/0/}album"
-    ):
-        location = elem.find("{http://xspf.org/ns/0/}location").text
-        albums.append(location)
+def sync_playlist(sp, username, filename, jobs=1, cache=None):
+    """Make existing playlists match the files exactly, with as few requests as possible."""
+    catalog = PlaylistCatalog(sp, username, jobs=jobs, cache=cache)
+
+    for reader in _playlist_readers(filename):
+        _sync_playlist_from_reader(sp, username, reader, catalog, jobs=jobs)
+
+
+def _import_saved_items(
+    xspf_path,
+    kind,
+    fetch,
+    add,
+    contains,
+    contains_limit,
+    jobs=1,
+    check_contains=False,
+    cache=None,
+    journal=None,
+    validator=None,
+):
+    """Save the items of an exported collection that aren't saved yet.
+
+    The saved collection is fetched once and the difference is computed
+    locally. With check_contains, small files are instead checked with the
+    ``*_contains`` endpoint when that needs fewer requests than fetching the
+    whole collection. With a validator invalid items are left out.
+    """
+    # how many items at the start of the file a previous run has saved
+    done = 0
+    if journal is not None:
+        if journal.get(("saved_imported", kind)):
+            logger.info("Skipping saved %s, imported before", kind)
+            return
+        done = journal.get(("saved_items", kind), 0)
+
+    key = kind[:-1]
+    first = fetch(limit=50, offset=0)
+    remaining_pages = max(0, -(-first["total"] // 50) - 1)
+
+    with _open_collection(xspf_path, f"saved_{kind}") as reader:
+        locations = itertools.islice(reader.locations(), done, None)
+        head = []
+        if check_contains:
+            head = list(
+                itertools.islice(locations, remaining_pages * contains_limit + 1)
+            )
+
+        if check_contains and len(head) <= remaining_pages * contains_limit:
+            logger.info("checking %d %s with the contains endpoint", len(head), kind)
+            candidates = list(dict.fromkeys(head))
+            if validator is not None:
+                valid = validator.valid(candidates)
+                for uri in candidates:
+                    if uri not in valid:
+                        logger.warning("Skipped invalid %s %s", kind[:-1], uri)
+                candidates = [uri for uri in candidates if uri in valid]
+            missing = []
+            for chunk in chunks(candidates, contains_limit):
+                saved = contains(chunk)
+                missing.extend(
+                    uri for uri, is_saved in zip(chunk, saved) if not is_saved
+                )
+            uris = iter(missing)
+            existing = set()
+            # the missing items are no longer in file order
+            progress = None
+        else:
+            uris = itertools.chain(head, locations)
+            existing = {
+                item[key]["uri"]
+                for page in iter_pages(fetch, limit=50, jobs=jobs, first=first)
+                for item in page["items"]
+            }
+            progress = done
+
+        skipped = 0
+        added = 0
+        new_items = []
+        # the position in the file of every pending item
+        new_positions = []
+        position = done
+        for batch in iter_in_background(batched(uris, 50)):
+            valid = None
+            if validator is not None:
+                valid = validator.valid(uri for uri in batch if uri not in existing)
+            for uri in batch:
+                if uri in existing:
+                    skipped += 1
+                elif valid is not None and uri not in valid:
+                    logger.warning("Skipped invalid %s %s", kind[:-1], uri)
+                else:
+                    existing.add(uri)
+                    new_items.append(uri)
+                    new_positions.append(position)
+                position += 1
+            while len(new_items) >= 50:
+                add(new_items[:50])
+                logger.info("Added %d new %s to saved %s", 50, kind, kind)
+                added += 50
+                del new_items[:50]
+                del new_positions[:50]
+            if journal is not None and progress is not None:
+                # every item before the first pending one is saved
+                complete = new_positions[0] if new_positions else position
+                if complete > progress:
+                    journal.record(("saved_items", kind), complete)
+                    progress = complete
+        if new_items:
+            add(new_items)
+            logger.info("Added %d new %s to saved %s", len(new_items), kind, kind)
+            added += len(new_items)
+        if journal is not None:
+            journal.record(("saved_imported", kind))
+
+    if added and cache is not None:
+        cache.invalidate_saved(kind)
+    if skipped:
+        logger.info("Skipped %d %s that were already saved", skipped, kind)
+
+
+def import_saved_tracks(
+    sp, filename, jobs=1, check_contains=False, cache=None, journal=None, validator=None
+):
+    _import_saved_items(
+        f"{filename}/{constants.FILEPATH_SAVED_TRACKS}",
+        "tracks",
+        _saved_fetch(sp, "tracks", cache),
+        lambda tracks: sp.current_user_saved_tracks_add(tracks=tracks),
+        lambda tracks: sp.current_user_saved_tracks_contains(tracks=tracks),
+        50,
+        jobs=jobs,
+        check_contains=check_contains,
+        cache=cache,
+        journal=journal,
+        validator=validator,
+    )
 
-    for albums_chunk in chunks(albums, 50):
-        sp.current_user_saved_albums_add(albums=albums_chunk)
-        logger.info("Added %d new tracks to saved albums", len(albums_chunk))
 
+def import_albums(
+    sp, filename, jobs=1, check_contains=False, cache=None, journal=None, validator=None
+):
+    _import_saved_items(
+        f"{filename}/{constants.FILEPATH_SAVED_ALBUMS}",
+        "albums",
+        _saved_fetch(sp, "albums", cache),
+        lambda albums: sp.current_user_saved_albums_add(albums=albums),
+        lambda albums: sp.current_user_saved_albums_contains(albums=albums),
+        20,
+        jobs=jobs,
+        check_contains=check_contains,
+        cache=cache,
+        journal=journal,
+        validator=validator,
+    )
 
-def import_shows(sp, filename):
-    tree = xml.etree.ElementTree.parse(f"{filename}/{constants.FILEPATH_SAVED_SHOWS}")
-    root = tree.getroot()
 
-    shows = []
+def import_shows(
+    sp, filename, jobs=1, check_contains=False, cache=None, journal=None, validator=None
+):
+    _import_saved_items(
+        f"{filename}/{constants.FILEPATH_SAVED_SHOWS}",
+        "shows",
+        _saved_fetch(sp, "shows", cache),
+        lambda shows: sp.current_user_saved_shows_add(shows=shows),
+        lambda shows: sp.current_user_saved_shows_contains(shows=shows),
+        50,
+        jobs=jobs,
+        check_contains=check_contains,
+        cache=cache,
+        journal=journal,
+        validator=validator,
+    )
+
+
+def convert(source, dest):
+    """Convert an export between XSPF files and a library bundle.
 
-    for elem in root.findall(
-        "{http://xspf.org/ns/0/}showList/{http://xspf.org/ns/0/}show"
+    A bundle (or a directory with one) is written out as XSPF files into the
+    directory dest, a directory of XSPF files is packed into a bundle there.
+    """
+    if not os.path.isdir(dest):
+        os.mkdir(dest)
+
+    source_bundle = source
+    if os.path.isdir(source):
+        source_bundle = os.path.join(source, constants.FILEPATH_BUNDLE)
+
+    if _is_bundle(source_bundle):
+        with bundle.BundleReader(source_bundle) as reader:
+            for collection in reader:
+                if collection.pl_type == "saved_albums":
+                    write_albums(dest, collection.records())
+                elif collection.pl_type == "saved_shows":
+                    write_shows(dest, collection.records())
+                else:
+                    write_playlist(
+                        collection.title,
+                        dest,
+                        collection.records(),
+                        pl_type=collection.pl_type,
+                        location=collection.location,
+                        public=collection.public,
+                        collaborative=collection.collaborative,
+                    )
+        return
+
+    bundle_path = os.path.join(dest, constants.FILEPATH_BUNDLE)
+    with bundle.BundleWriter(bundle_path) as writer:
+        for reader in _playlist_readers(source):
+            writer.add(
+                reader.title,
+                "playlist",
+                reader.records(),
+                location=reader.location,
+                public=reader.public,
+                collaborative=reader.collaborative,
+            )
+        for filepath, pl_type, name in (
+            (constants.FILEPATH_SAVED_TRACKS, "saved_tracks", "Saved tracks"),
+            (constants.FILEPATH_SAVED_ALBUMS, "saved_albums", "Saved albums"),
+            (constants.FILEPATH_SAVED_SHOWS, "saved_shows", "Saved shows"),
+        ):
+            xspf_path = os.path.join(source, filepath)
+            if os.path.isfile(xspf_path):
+                with XspfReader(xspf_path) as reader:
+                    writer.add(name, pl_type, reader.records())
+    logger.info('saved library bundle to "%s"', bundle_path)
+
+
+# --- watch ------------------------------------------------------------------
+
+# manifest key, kind and file of every saved collection
+SAVED_COLLECTIONS = (
+    ("saved_tracks", "tracks", constants.FILEPATH_SAVED_TRACKS),
+    ("saved_albums", "albums", constants.FILEPATH_SAVED_ALBUMS),
+    ("saved_shows", "shows", constants.FILEPATH_SAVED_SHOWS),
+)
+
+
+def poll_library(sp, username, dirname, jobs=1):
+    """Find out cheaply what changed since the last export into dirname.
+
+    Only the playlists (with their snapshot_id) and the newest item of every
+    saved collection are fetched. Returns the manifest keys that are out of
+    date, the playlists and the number of requests made.
+    """
+    manifest = _load_manifest(dirname)
+    playlists = _fetch_playlists(sp, username, jobs)
+    cost = max(1, -(-len(playlists) // 50))
+
+    changed = set()
+    groups, current = _playlist_groups(dirname, playlists)
+    if current != manifest.get("playlists") or not all(
+        os.path.isfile(path) for path in groups
     ):
-        location = elem.find("{http://xspf.org/ns/0/}location").text
-        shows.append(location)
+        changed.add("playlists")
+
+    for key, kind, filepath in SAVED_COLLECTIONS:
+        page = _saved_fetch(sp, kind)(limit=1, offset=0)
+        cost += 1
+        state = {
+            "total": page["total"],
+            "added_at": page["items"][0]["added_at"] if page["items"] else None,
+        }
+        if state != manifest.get(key) or not os.path.isfile(f"{dirname}/{filepath}"):
+            changed.add(key)
+    return changed, playlists, cost
+
+
+def sync_changes(sp, username, dirname, changed, playlists, jobs=1):
+    """Run the incremental exports of the changed manifest keys."""
+    if "playlists" in changed or "saved_tracks" in changed:
+        export_playlists(sp, username, dirname, jobs=jobs, playlists=playlists)
+    if "saved_albums" in changed:
+        export_albums(sp, dirname, jobs=jobs)
+    if "saved_shows" in changed:
+        export_shows(sp, dirname, jobs=jobs)
+
+
+def watch_library(
+    sp, username, dirname, interval, wake, stop, api_stats, jobs=1, status=None
+):
+    """Keep the export in dirname up to date until stop is set.
+
+    Every cycle polls the library with poll_library() and exports what
+    changed, then waits for the adaptive interval (a watch.PollInterval) or
+    until wake is set. Failed cycles are logged and retried after a longer
+    interval. The ``status`` dict, if given, is updated after every cycle.
+    """
+    status = status if status is not None else {}
+    status.update(
+        polls=0, syncs=0, last_poll=None, last_changes=[], interval=interval.seconds
+    )
+
+    while not stop.is_set():
+        wake.clear()
+        rate_limited = api_stats.rate_limited()
+        changed, cost, failed = set(), 0, False
+        try:
+            changed, playlists, cost = poll_library(sp, username, dirname, jobs)
+            if changed:
+                logger.info(
+                    "changed since the last export: %s", ", ".join(sorted(changed))
+                )
+                sync_changes(sp, username, dirname, changed, playlists, jobs)
+                status["syncs"] += 1
+        except (spotipy.SpotifyException, OSError) as e:
+            # requests' exceptions are OSErrors too
+            logger.warning("watch cycle failed: %s", e)
+            failed = True
+
+        seconds = interval.update(
+            bool(changed), cost, failed or api_stats.rate_limited() > rate_limited
+        )
+        status.update(
+            polls=status["polls"] + 1,
+            last_poll=time.time(),
+            last_changes=sorted(changed),
+            interval=seconds,
+        )
+        logger.info("next poll in %.0f s", seconds)
+        wake.wait(seconds)
+
+
+def run_watch(args, username, sp, api_stats):
+    """Run watch_library() with its signal handlers and control socket.
+
+    SIGUSR1 polls right away, SIGTERM stops after the current cycle.
+    """
+    wake = threading.Event()
+    stop = threading.Event()
+    interval = watch.PollInterval(*args.interval, args.rate, constants.WATCH_RATE_SHARE)
+    status = {}
+
+    def on_signal(*events):
+        def set_events():
+            for event in events:
+                event.set()
+
+        def handler(signum, frame):
+            # Event.set() takes a lock the interrupted main thread may hold
+            threading.Thread(target=set_events, daemon=True).start()
+
+        return handler
+
+    if hasattr(signal, "SIGUSR1"):
+        # not on Windows
+        signal.signal(signal.SIGUSR1, on_signal(wake))
+    signal.signal(signal.SIGTERM, on_signal(stop, wake))
+
+    control = None
+    if args.control_socket is not None:
+        control = watch.ControlServer(
+            args.control_socket, wake, stop, lambda: status
+        ).start()
+    try:
+        watch_library(
+            sp,
+            username,
+            args.path,
+            interval,
+            wake,
+            stop,
+            api_stats,
+            jobs=args.jobs,
+            status=status,
+        )
+    finally:
+        if control is not None:
+            control.close()
+
+
+# --- verify -----------------------------------------------------------------
+
+# entries of a collection that differs that are logged at most
+VERIFY_MAX_DIFFERENCES = 10
+
+# a playlist of an export, with a function that reads its records again
+ExportedPlaylist = collections.namedtuple(
+    "ExportedPlaylist", ("path", "title", "location", "content_hash", "records")
+)
+
+
+def _exported_playlists(filename):
+    """Read the headers of the playlists of an export into ExportedPlaylists.
+
+    Files written with a content hash aren't parsed any further, the hash of
+    older files and of bundle collections is computed from their tracks.
+    """
+    exported = []
+    for reader in _playlist_readers(filename):
+        if isinstance(reader, XspfReader):
+            read_records = functools.partial(_read_xspf_records, reader.path)
+        else:
+            read_records = reader.records
+        content_hash = reader.content_hash
+        if content_hash is None:
+            content_hash = records.ContentHash(reader.locations()).hexdigest()
+        exported.append(
+            ExportedPlaylist(
+                reader.path, reader.title, reader.location, content_hash, read_records
+            )
+        )
+    return exported
+
+
+def _live_playlist_hash(sp, playlist_id, jobs=1):
+    """ContentHash digest of a playlist's tracks, from uri-only pages."""
+    fetch = _playlist_items_fetch(sp, playlist_id, constants.FIELDS_PLAYLIST_URIS)
+    content_hash = records.ContentHash()
+    for page in iter_pages(fetch, limit=100, jobs=jobs):
+        for track in _exported_tracks(page):
+            content_hash.update(track["uri"])
+    return content_hash.hexdigest()
+
+
+def _log_differences(name, exported, live, ordered=True):
+    """Log the entries in which the records of the export and the account differ.
+
+    Unless ordered, only entries that are missing on one side are counted.
+    """
+    exported = list(exported)
+    live = list(live)
+    if ordered:
+        matcher = difflib.SequenceMatcher(
+            None,
+            [record.uri for record in exported],
+            [record.uri for record in live],
+            autojunk=False,
+        )
+        ranges = [
+            (exported[i1:i2], live[j1:j2])
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"
+        ]
+    else:
+        exported_uris = {record.uri for record in exported}
+        live_uris = {record.uri for record in live}
+        ranges = [
+            (
+                [record for record in exported if record.uri not in live_uris],
+                [record for record in live if record.uri not in exported_uris],
+            )
+        ]
+    lines = []
+    only_exported = only_live = 0
+    for removed, added in ranges:
+        only_exported += len(removed)
+        only_live += len(added)
+        lines.extend(f"  - {r.title} - {r.artists} ({r.uri})" for r in removed)
+        lines.extend(f"  + {r.title} - {r.artists} ({r.uri})" for r in added)
+    if len(lines) > VERIFY_MAX_DIFFERENCES:
+        hidden = len(lines) - VERIFY_MAX_DIFFERENCES
+        lines = lines[:VERIFY_MAX_DIFFERENCES] + [f"  ... and {hidden} more"]
+    logger.warning(
+        "%s differs: %d entries only in the export (-), %d only in the account (+)\n%s",
+        name,
+        only_exported,
+        only_live,
+        "\n".join(lines),
+    )
+
+
+def _verify_saved(sp, filename, key, kind, filepath, manifest, jobs=1):
+    """Return whether a saved collection of the account matches the export.
+
+    Saved items are ordered by the time they were added, which an import
+    can't reproduce, so a collection with the same items in another order
+    still matches.
+    """
+    xspf_path = f"{filename}/{filepath}"
+    process = {
+        "tracks": process_tracks,
+        "albums": process_albums,
+        "shows": process_shows,
+    }[kind]
+    try:
+        with _open_collection(xspf_path, key) as reader:
+            content_hash = reader.content_hash
+            if content_hash is None:
+                content_hash = records.ContentHash(reader.locations()).hexdigest()
+    except FileNotFoundError:
+        logger.warning("saved %s are not in the export", kind)
+        return False
+
+    fetch = _saved_fetch(sp, kind)
+    first = fetch(limit=50, offset=0)
+    state = {
+        "total": first["total"],
+        "added_at": first["items"][0]["added_at"] if first["items"] else None,
+    }
+    if manifest.get(key) == state:
+        return True
+
+    live = [
+        record
+        for page in iter_pages(fetch, limit=50, jobs=jobs, first=first)
+        for record in process(page)
+    ]
+    if records.ContentHash(record.uri for record in live).hexdigest() == content_hash:
+        return True
+    with _open_collection(xspf_path, key) as reader:
+        exported = list(reader.records())
+    if {record.uri for record in exported} == {record.uri for record in live}:
+        logger.info("saved %s match the export in a different order", kind)
+        return True
+    _log_differences(f"saved {kind}", exported, live, ordered=False)
+    return False
+
+
+def verify_export(sp, username, filename, jobs=1, full=False):
+    """Compare an export with the account, returns the number of differences.
+
+    filename is an export directory, a bundle or a single .xspf file.
+    Exported playlists are matched to the account's playlists by their uri,
+    or else by name (after an import into another account); a single .xspf
+    file is only compared with its own playlist. A playlist whose
+    snapshot_id is still the one the manifest recorded at export time is
+    taken as equal, unless full. The others are compared by content hash
+    with a uri-only fetch. Only playlists that differ are downloaded
+    completely, to log how they differ.
+    """
+    dirname = filename if os.path.isdir(filename) else os.path.dirname(filename) or "."
+    manifest = {} if full else _load_manifest(dirname)
+    previous = manifest.get("playlists", {})
+
+    exported = _exported_playlists(filename)
+    playlists = _fetch_playlists(sp, username, jobs)
+
+    by_uri = {playlist["uri"]: playlist for playlist in playlists}
+    matches = {}
+    for n, entry in enumerate(exported):
+        if entry.location in by_uri:
+            matches[n] = by_uri[entry.location]
+    matched_ids = {playlist["id"] for playlist in matches.values()}
+    by_name = {}
+    for playlist in playlists:
+        if playlist["id"] not in matched_ids:
+            by_name.setdefault(playlist["name"], []).append(playlist)
+    for n, entry in enumerate(exported):
+        if n not in matches and by_name.get(entry.title):
+            matches[n] = by_name[entry.title].pop(0)
+            matched_ids.add(matches[n]["id"])
+
+    workers, page_jobs = split_jobs(jobs, len(matches))
+
+    def check(n):
+        entry, playlist = exported[n], matches[n]
+        if previous.get(playlist["id"]) == {
+            "snapshot_id": playlist["snapshot_id"],
+            "path": os.path.basename(entry.path),
+        }:
+            return "unchanged"
+        if (
+            _live_playlist_hash(sp, playlist["id"], jobs=page_jobs)
+            == entry.content_hash
+        ):
+            return "equal"
+        fetch = _playlist_items_fetch(
+            sp, playlist["id"], constants.FIELDS_PLAYLIST_TRACKS
+        )
+        _log_differences(
+            f'playlist "{entry.title}"',
+            entry.records(),
+            (
+                record
+                for page in iter_pages(fetch, limit=100, jobs=page_jobs)
+                for record in process_tracks(page)
+            ),
+        )
+        return "differs"
+
+    results = collections.Counter(map_pipelined(check, sorted(matches), jobs=workers))
+
+    for n, entry in enumerate(exported):
+        if n not in matches:
+            logger.warning('playlist "%s" is not in the account', entry.title)
+            results["missing"] += 1
+    # a single .xspf file holds only one of the account's playlists
+    complete = os.path.isdir(filename) or _is_bundle(filename)
+    for playlist in playlists:
+        if complete and playlist["id"] not in matched_ids:
+            logger.warning('playlist "%s" is not in the export', playlist["name"])
+            results["missing"] += 1
+
+    if complete:
+        for key, kind, filepath in SAVED_COLLECTIONS:
+            if not _verify_saved(sp, filename, key, kind, filepath, manifest, jobs):
+                results["saved differ"] += 1
+
+    logger.info(
+        "verified %d playlists: %d unchanged since the export, %d equal by hash, "
+        "%d differ, %d only in the export or the account; %d saved collections differ",
+        len(exported),
+        results["unchanged"],
+        results["equal"],
+        results["differs"],
+        results["missing"],
+        results["saved differ"],
+    )
+    return results["differs"] + results["missing"] + results["saved differ"]
+
+
+# --- async engine -----------------------------------------------------------
+#
+# The export, import and delete commands on async_client.AsyncSpotifyClient.
+# They mirror the threaded functions above, but a single event loop keeps up
+# to jobs requests in flight across all playlists and collections.
+
+
+# pages of records that wait for the writer thread of an async export
+ASYNC_WRITE_PAGES = 4
+
+# marks the end of the pages for the writer thread
+_END_OF_PAGES = object()
+
+
+async def _run_limited(function, items, jobs):
+    """Await function(item) for every item, at most jobs at a time."""
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run(item):
+        async with semaphore:
+            return await function(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+async def _run_pipelined_async(coroutines, jobs):
+    """Like run_pipelined(), for an async iterator of coroutines."""
+    pending = set()
+    try:
+        async for coroutine in coroutines:
+            pending.add(asyncio.ensure_future(coroutine))
+            if len(pending) >= jobs:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    task.result()
+        await asyncio.gather(*pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _write_pages_async(write, pages):
+    """Call write(records) on a worker thread with the records of pages.
+
+    pages is an async iterator of iterables of records. The writer streams
+    them to the file while the next pages are fetched, with at most
+    ASYNC_WRITE_PAGES of them waiting in between, so memory stays flat like
+    in the threaded export. If pages raises, the write is aborted and the old
+    file is kept.
+    """
+    loop = asyncio.get_running_loop()
+    space = asyncio.Semaphore(ASYNC_WRITE_PAGES)
+    pending = queue.SimpleQueue()
+    finished = failed = False
+
+    def take():
+        nonlocal finished
+        item = pending.get()
+        loop.call_soon_threadsafe(space.release)
+        finished = item is _END_OF_PAGES or isinstance(item, BaseException)
+        return item
+
+    def records():
+        while (item := take()) is not _END_OF_PAGES:
+            if isinstance(item, BaseException):
+                raise RuntimeError("fetching the pages failed") from item
+            yield from item
+
+    def consume():
+        nonlocal failed
+        try:
+            write(records())
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # take the pages that are left if the write stopped early, so
+            # that the event loop doesn't wait for space forever
+            while not finished:
+                take()
+
+    writer = asyncio.ensure_future(asyncio.to_thread(consume))
+    try:
+        async for page in pages:
+            await space.acquire()
+            if failed:
+                # its error is raised below
+                break
+            pending.put(page)
+    except BaseException as e:
+        pending.put(e)
+        await asyncio.gather(writer, return_exceptions=True)
+        raise
+    pending.put(_END_OF_PAGES)
+    await writer
+
+
+def _projected_async(fetch, fields):
+    """Like projected(), for coroutine fetch functions."""
+    spec = field_filter.parse_fields(fields)
+
+    async def fetch_projected(*args, **kwargs):
+        return field_filter.project(await fetch(*args, **kwargs), spec)
+
+    return fetch_projected
+
+
+def _saved_fetch_async(client, kind):
+    """Like _saved_fetch(), for the async engine."""
+    fields = {
+        "tracks": constants.FIELDS_SAVED_TRACKS,
+        "albums": constants.FIELDS_SAVED_ALBUMS,
+        "shows": constants.FIELDS_SAVED_SHOWS,
+    }[kind]
+    return _projected_async(getattr(client, f"current_user_saved_{kind}"), fields)
+
+
+async def _fetch_items_async(fetch, limit, jobs):
+    items = []
+    async for page in async_client.iter_pages(fetch, limit=limit, window=jobs):
+        items.extend(page["items"])
+    return items
+
+
+async def _playlists_async(client, username, jobs):
+    return await _fetch_items_async(
+        _projected_async(
+            functools.partial(client.user_playlists, username),
+            constants.FIELDS_PLAYLISTS,
+        ),
+        50,
+        jobs,
+    )
+
+
+async def _export_playlist_async(client, dirname, playlist, jobs):
+    fetch = functools.partial(
+        client.playlist_items, playlist["id"], constants.FIELDS_PLAYLIST_TRACKS
+    )
+    # rendered on a worker thread while the event loop goes on with requests
+    await _write_pages_async(
+        functools.partial(
+            write_playlist,
+            playlist["name"],
+            dirname,
+            pl_type="playlist",
+            location=playlist["uri"],
+            public=playlist["public"],
+            collaborative=playlist["collaborative"],
+        ),
+        (
+            process_tracks(page)
+            async for page in async_client.iter_pages(fetch, limit=100, window=jobs)
+        ),
+    )
+
+
+async def _export_saved_async(client, kind, process, write, jobs):
+    """Export a saved collection, returns its manifest state."""
+    fetch = _saved_fetch_async(client, kind)
+    first = await fetch(limit=50, offset=0)
+    state = {
+        "total": first["total"],
+        "added_at": first["items"][0]["added_at"] if first["items"] else None,
+    }
+    await _write_pages_async(
+        write,
+        (
+            process(page)
+            async for page in async_client.iter_pages(
+                fetch, limit=50, window=jobs, first=first
+            )
+        ),
+    )
+    return state
+
+
+async def export_library_async(client, username, dirname, jobs=32):
+    """Export playlists and saved collections on the async engine.
+
+    Everything is exported (like --full); the manifest is written just like
+    by export_playlists() and friends, so later exports can be incremental.
+    """
+    if not os.path.isdir(dirname):
+        os.mkdir(dirname)
+
+    groups, current = _playlist_groups(
+        dirname, await _playlists_async(client, username, jobs)
+    )
+
+    async def export_group(group):
+        for playlist in group:
+            await _export_playlist_async(client, dirname, playlist, jobs)
+
+    saved = (
+        (
+            "saved_tracks",
+            "tracks",
+            process_tracks,
+            functools.partial(
+                write_playlist, "Saved tracks", dirname, pl_type="saved_tracks"
+            ),
+        ),
+        (
+            "saved_albums",
+            "albums",
+            process_albums,
+            functools.partial(write_albums, dirname),
+        ),
+        (
+            "saved_shows",
+            "shows",
+            process_shows,
+            functools.partial(write_shows, dirname),
+        ),
+    )
+    _, *states = await asyncio.gather(
+        _run_limited(export_group, groups.values(), jobs),
+        *(
+            _export_saved_async(client, kind, process, write, jobs)
+            for _, kind, process, write in saved
+        ),
+    )
+
+    manifest = _load_manifest(dirname)
+    manifest["playlists"] = current
+    for (key, *_), state in zip(saved, states):
+        manifest[key] = state
+    _save_manifest(dirname, manifest)
+
+
+async def _import_playlist_async(client, username, reader, by_name, jobs):
+    name = reader.title
+    playlist_id = by_name.get(name)
+    if playlist_id is None:
+        playlist = await client.user_playlist_create(
+            username, name, public=reader.public
+        )
+        playlist_id = by_name[name] = playlist["id"]
+        logger.info('Created new playlist "%s"', name)
+        existing_track_uris = set()
+    else:
+        logger.info('Using existing playlist "%s"', name)
+        fetch = functools.partial(
+            client.playlist_items, playlist_id, constants.FIELDS_PLAYLIST_URIS
+        )
+        existing_track_uris = {
+            item["track"]["uri"]
+            async for page in async_client.iter_pages(fetch, limit=100, window=jobs)
+            for item in page["items"]
+            if item["track"] is not None
+        }
+
+    if reader.collaborative:
+        await client.playlist_change_details(playlist_id, collaborative=True)
+
+    new_tracks = [
+        track for track in reader.locations() if track not in existing_track_uris
+    ]
+    # in order, the position of every track depends on the ones before it
+    for tracks in chunks(new_tracks, 100):
+        await client.playlist_add_items(playlist_id, tracks)
+    logger.info('Added %d new tracks to playlist "%s"', len(new_tracks), name)
+    logger.info('Imported playlist "%s" from "%s"', name, reader.path)
+
+
+async def _import_saved_async(client, xspf_path, kind, jobs):
+    key = kind[:-1]
+    fetch = _saved_fetch_async(client, kind)
+    add = getattr(client, f"current_user_saved_{kind}_add")
+
+    existing = {item[key]["uri"] for item in await _fetch_items_async(fetch, 50, jobs)}
+    with _open_collection(xspf_path, f"saved_{kind}") as reader:
+        uris = list(dict.fromkeys(reader.locations()))
+    new_items = [uri for uri in uris if uri not in existing]
+    # in file order, like the threaded import
+    for items in chunks(new_items, 50):
+        await add(items)
+    logger.info("Added %d new %s to saved %s", len(new_items), kind, kind)
+    if len(uris) > len(new_items):
+        logger.info(
+            "Skipped %d %s that were already saved", len(uris) - len(new_items), kind
+        )
+
+
+async def import_playlists_async(client, username, filename, jobs=32, processes=1):
+    """Import the playlists of a file, directory or bundle on the async engine.
+
+    Files are parsed on up to processes worker processes. Up to jobs
+    playlists are imported at the same time. Files with the same playlist
+    name are imported one after another, like in import_playlist().
+    """
+    by_name = {}
+    for playlist in await _playlists_async(client, username, jobs):
+        # keep the first playlist with a given name, like PlaylistCatalog
+        by_name.setdefault(playlist["name"], playlist["id"])
+
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def import_one(reader, previous):
+        try:
+            if previous is not None:
+                # its errors are reported by the gather below
+                await asyncio.wait([previous])
+            await _import_playlist_async(client, username, reader, by_name, jobs)
+        finally:
+            semaphore.release()
+
+    readers = _playlist_readers(filename, processes=processes)
+    previous = {}
+    tasks = []
+    try:
+        # files are parsed on a worker thread, so the event loop isn't blocked
+        while (reader := await asyncio.to_thread(next, readers, None)) is not None:
+            await semaphore.acquire()
+            task = asyncio.create_task(import_one(reader, previous.get(reader.title)))
+            previous[reader.title] = task
+            tasks.append(task)
+    finally:
+        await asyncio.gather(*tasks)
+        readers.close()
+
+
+async def import_library_async(client, username, filename, jobs=32, processes=1):
+    """Import playlists and saved collections on the async engine."""
+    await import_playlists_async(
+        client, username, filename, jobs=jobs, processes=processes
+    )
+    await asyncio.gather(
+        *(
+            _import_saved_async(client, f"{filename}/{path}", kind, jobs)
+            for path, kind in (
+                (constants.FILEPATH_SAVED_TRACKS, "tracks"),
+                (constants.FILEPATH_SAVED_ALBUMS, "albums"),
+                (constants.FILEPATH_SAVED_SHOWS, "shows"),
+            )
+        )
+    )
+
+
+async def delete_library_async(client, jobs=32, assume_yes=False):
+    """Delete playlists and saved collections on the async engine, after confirmation."""
+    user_id = (await client.me())["id"]
+
+    playlists = await _playlists_async(client, user_id, jobs)
+    confirmation = _confirm(
+        f"Do you really want to delete all playlists from account '{user_id}'? (yes/no): ",
+        assume_yes,
+    )
+    owned = [playlist for playlist in playlists if playlist["owner"]["id"] == user_id]
+    if confirmation.lower() != "yes":
+        for playlist in owned:
+            logger.info("Skipped deletion of playlist: %s", playlist["name"])
+    else:
+
+        async def unfollow(playlist):
+            await client.current_user_unfollow_playlist(playlist["id"])
+            logger.info("Deleted playlist: %s", playlist["name"])
 
-    for shows_chunk in chunks(shows, 50):
-        sp.current_user_saved_shows_add(shows=shows_chunk)
-        logger.info("Added %d new items to saved shows", len(shows_chunk))
+        await _run_limited(unfollow, owned, jobs)
+
+    for kind in ("tracks", "albums", "shows"):
+        await _delete_saved_async(client, kind, jobs, assume_yes)
+
+
+async def _delete_saved_async(client, kind, jobs, assume_yes):
+    """Like _delete_saved_items(), for the async engine."""
+    key = kind[:-1]
+    fetch = _saved_fetch_async(client, kind)
+    delete = getattr(client, f"current_user_saved_{kind}_delete")
+    first = await fetch(limit=50, offset=0)
+    if not first["total"]:
+        logger.info("No saved %s found.", kind)
+        return
+    confirmation = _confirm(
+        f"You have {first['total']} saved {kind}. Do you want to delete them all? (yes/no): ",
+        assume_yes,
+    )
+    if confirmation.lower() != "yes":
+        logger.info("Operation cancelled. No %s were deleted.", kind)
+        return
+
+    async def delete_page(ids):
+        await delete(ids)
+        logger.info("Deleted %d %s from saved %s.", len(ids), kind, kind)
+
+    # pages are deleted from the end of the collection while the pages
+    # before them are fetched
+    await _run_pipelined_async(
+        (
+            delete_page([item[key]["id"] for item in page["items"]])
+            async for page in async_client.iter_pages(
+                fetch, limit=50, window=jobs, first=first, reverse=True
+            )
+            if page["items"]
+        ),
+        jobs,
+    )
+    logger.info("All saved %s have been deleted.", kind)
 
 
 def main():
@@ -496,54 +2524,579 @@ def main():
     parser = argparse.ArgumentParser(description="Spotify Playlist Management Script")
     help_txt = """Command to execute: 'export' to export library items, 
     'import' to import library items, 
+    'sync' to make playlists match the files exactly, 
+    'watch' to keep an export up to date by polling for changes, 
+    'verify' to check that an export matches the account, 
+    'convert' to convert an export between XSPF files and a bundle, 
     'delete' to delete all library items"""
     parser.add_argument(
-        "command", choices=["export", "import", "delete"], help=help_txt
+        "command",
+        choices=["export", "import", "sync", "watch", "verify", "convert", "delete"],
+        help=help_txt,
     )
     parser.add_argument(
         "path",
         nargs="?",
-        help="File path for import or directory path for export (not needed for delete)",
+        help="File path for import, sync and verify or directory path for export and watch (not needed for delete)",
+    )
+    parser.add_argument(
+        "dest",
+        nargs="?",
+        help="Directory to write the converted export to (only for convert)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help=f"Number of playlists and pages to fetch concurrently (default: 1, {constants.ASYNC_JOBS} with --engine async)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Run API requests on a pool of threads, or on one asyncio event loop for many more requests in flight; async supports export to XSPF, import and delete and needs aiohttp (default: threads)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=constants.REQUESTS_PER_SECOND,
+        help=f"Maximum number of API requests per second (default: {constants.REQUESTS_PER_SECOND})",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="Number of HTTP connections to keep open for reuse (default: enough for all --jobs workers, at least 10)",
+    )
+    parser.add_argument(
+        "--check-contains",
+        action="store_true",
+        help="On import, check small files with the *_contains endpoints when that needs fewer requests than fetching the saved library",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="On import, skip malformed URIs and look up the others in batches with the multi-get endpoints, so one invalid URI doesn't fail a whole chunk",
+    )
+    parser.add_argument(
+        "--uri-cache",
+        metavar="FILE",
+        help="SQLite file remembering the URIs checked by --validate, shared by all accounts and runs",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["xspf", "bundle"],
+        default="xspf",
+        help=f"Export one .xspf file per playlist, or everything into a compact {constants.FILEPATH_BUNDLE} (default: xspf)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Export everything again, even items unchanged since the last export; with verify, compare playlists even if their snapshot_id is still the exported one",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="SQLite file to cache the library in between runs",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=constants.CACHE_TTL,
+        metavar="SECONDS",
+        help=f"How long cached playlist lists and saved items stay valid (default: {constants.CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Skip the work an interrupted import or export already finished, as recorded in {constants.FILEPATH_JOURNAL} in the target directory",
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Answer the confirmation prompts of delete with yes",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Run the command for every [spotify:NAME] section of auth.ini (or every token cache in --token-dir), each with its own subdirectory of path",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of accounts to process in parallel in batch mode, and of processes parsing the files of a directory import otherwise (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--token-dir",
+        metavar="DIR",
+        help="In batch mode, process one account per spotipy token cache (.cache-USERNAME) in DIR, with the app settings of [spotify]",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        nargs=2,
+        default=constants.WATCH_INTERVAL,
+        metavar=("MIN", "MAX"),
+        help=f"Bounds in seconds of the polling interval of watch, which shrinks while the library changes and grows while it doesn't (default: {constants.WATCH_INTERVAL[0]} {constants.WATCH_INTERVAL[1]})",
+    )
+    parser.add_argument(
+        "--control-socket",
+        metavar="PATH",
+        help="Unix socket on which watch accepts the commands sync, status and stop",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print API calls, latencies, retries and phase timings at exit",
+    )
+    parser.add_argument(
+        "--stats-json",
+        metavar="FILE",
+        help="Write API and phase statistics as JSON to FILE at exit",
     )
 
     args = parser.parse_args()
+    if args.command == "convert":
+        if args.path is None or args.dest is None:
+            parser.error("The 'convert' command requires a path and a dest argument.")
+        convert(args.path, args.dest)
+        return
+    if args.jobs is None:
+        args.jobs = constants.ASYNC_JOBS if args.engine == "async" else 1
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if args.rate <= 0:
+        parser.error("--rate must be positive.")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1.")
+    if args.pool_size is None:
+        args.pool_size = scheduler.default_pool_size(args.jobs)
+    elif args.pool_size < 1:
+        parser.error("--pool-size must be at least 1.")
+
+    if args.interval[0] <= 0 or args.interval[0] > args.interval[1]:
+        parser.error("--interval needs 0 < MIN <= MAX.")
+
+    if args.check_contains and args.command != "import":
+        parser.error("--check-contains is only used by import.")
+    if args.validate and args.command != "import":
+        parser.error("--validate is only used by import.")
+    if args.uri_cache is not None and not args.validate:
+        parser.error("--uri-cache needs --validate.")
+
+    if (
+        args.command in ("import", "sync", "export", "watch", "verify")
+        and args.path is None
+    ):
+        parser.error(f"The '{args.command}' command requires a path argument.")
+    if args.engine == "async":
+        if async_client is None:
+            parser.error("--engine async requires aiohttp (pip install aiohttp).")
+        unsupported = [
+            option
+            for option, used in (
+                ("sync", args.command == "sync"),
+                ("watch", args.command == "watch"),
+                ("verify", args.command == "verify"),
+                ("--format bundle", args.format == "bundle"),
+                ("--cache", args.cache is not None),
+                ("--resume", args.resume),
+                ("--check-contains", args.check_contains),
+                ("--validate", args.validate),
+            )
+            if used
+        ]
+        if unsupported:
+            parser.error(
+                f"--engine async doesn't support {', '.join(unsupported)}, use --engine threads."
+            )
+
+    if args.command == "watch":
+        unsupported = [
+            option
+            for option, used in (
+                ("--format bundle", args.format == "bundle"),
+                ("--full", args.full),
+                ("--cache", args.cache is not None),
+                ("--resume", args.resume),
+                ("--batch", args.batch),
+            )
+            if used
+        ]
+        if unsupported:
+            parser.error(f"watch doesn't support {', '.join(unsupported)}.")
+        if args.control_socket is not None and watch.ControlServer is None:
+            parser.error("--control-socket needs Unix domain sockets.")
+    elif args.control_socket is not None:
+        parser.error("--control-socket is only used by watch.")
 
     config = configparser.ConfigParser()
     config.read(constants.CONFIG_AUTH)
 
-    auth_manager = spotipy.oauth2.SpotifyOAuth(
-        client_id=config["spotify"]["client_id"],
-        client_secret=config["spotify"]["client_secret"],
-        redirect_uri=config["spotify"]["redirect_uri"],
+    if args.batch:
+        if args.command == "delete" and not args.yes:
+            parser.error("Deleting in batch mode requires --yes.")
+        accounts = batch_accounts(config, args.token_dir)
+        if not accounts:
+            parser.error(
+                "No accounts found: add [spotify:NAME] sections to "
+                f"{constants.CONFIG_AUTH} or use --token-dir."
+            )
+        results = run_batch(args, accounts)
+        if args.stats_json is not None:
+            with open(args.stats_json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+        if any(result["error"] is not None for result in results):
+            sys.exit(1)
+        return
+
+    api_stats = stats.ApiStats()
+    try:
+        differences = run_account(args, dict(config["spotify"]), api_stats)
+    finally:
+        if args.stats:
+            api_stats.print_report()
+        if args.stats_json is not None:
+            api_stats.write_json(args.stats_json)
+    if differences:
+        sys.exit(1)
+
+
+def build_auth_manager(account, session):
+    """Return the OAuth manager for an account (a section of auth.ini)."""
+    return scheduler.SharedSpotifyOAuth(
+        client_id=account["client_id"],
+        client_secret=account["client_secret"],
+        redirect_uri=account["redirect_uri"],
         scope=" ".join(constants.SCOPES),
         cache_handler=spotipy.cache_handler.CacheFileHandler(
-            username=config["spotify"]["username"],
+            cache_path=account.get("cache_path"),
+            username=account["username"],
         ),
         show_dialog=True,
+        requests_session=session,
+    )
+
+
+def build_client(account, rate, api_stats, pool_size=10):
+    """Return a scheduled client for an account (a section of auth.ini).
+
+    API and token requests share one session that keeps up to pool_size
+    connections alive.
+    """
+    session = api_stats.instrument(
+        scheduler.build_session(pool_size=pool_size, timeouts=constants.TIMEOUTS)
     )
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+    auth_manager = build_auth_manager(account, session)
+    return scheduler.ScheduledSpotify(
+        spotipy.Spotify(auth_manager=auth_manager, requests_session=session),
+        scheduler.TokenBucket(rate),
+        stats=api_stats,
+    )
+
+
+def build_async_client(account, rate, api_stats, concurrency):
+    """Return an async_client.AsyncSpotifyClient for an account.
+
+    Only token requests go through a requests session.
+    """
+    auth_manager = build_auth_manager(
+        account,
+        api_stats.instrument(scheduler.build_session(timeouts=constants.TIMEOUTS)),
+    )
+    return async_client.AsyncSpotifyClient(
+        auth_manager=auth_manager,
+        bucket=async_client.AsyncTokenBucket(rate),
+        concurrency=concurrency,
+        timeouts=constants.TIMEOUTS,
+        stats=api_stats,
+    )
+
+
+async def run_command_async(args, account, api_stats):
+    phase = api_stats.phase
+    username = account["username"]
+
+    async with build_async_client(account, args.rate, api_stats, args.jobs) as client:
+        with phase("authenticate"):
+            user_info = await client.me()
+        logger.info(
+            "Authenticated as: %s (%s)", user_info["display_name"], user_info["id"]
+        )
+
+        if args.command == "import":
+            with phase("import"):
+                await import_library_async(
+                    client,
+                    username,
+                    args.path,
+                    jobs=args.jobs,
+                    processes=args.processes,
+                )
+        elif args.command == "export":
+            with phase("export"):
+                await export_library_async(client, username, args.path, jobs=args.jobs)
+        elif args.command == "delete":
+            with phase("delete"):
+                await delete_library_async(client, jobs=args.jobs, assume_yes=args.yes)
+
 
-    user_info = sp.me()
+def run_account(args, account, api_stats):
+    """Run the command for one account.
+
+    Returns the number of differences found by verify, None otherwise.
+    """
+    if args.engine == "async":
+        asyncio.run(run_command_async(args, account, api_stats))
+        return
+
+    sp = build_client(account, args.rate, api_stats, pool_size=args.pool_size)
+
+    cache = None
+    if args.cache is not None:
+        cache = library_cache.LibraryCache(
+            args.cache, account["username"], ttl=args.cache_ttl
+        )
+    # shared by all accounts, the catalog is the same for everyone
+    uri_memo = None
+    if args.uri_cache is not None:
+        uri_memo = uri_validation.UriMemo(args.uri_cache, ttl=constants.URI_CACHE_TTL)
+
+    try:
+        return run_command(args, account["username"], sp, api_stats, cache, uri_memo)
+    finally:
+        if cache is not None:
+            cache.close()
+        if uri_memo is not None:
+            uri_memo.close()
+
+
+def batch_accounts(config, token_dir=None):
+    """Return the settings of every account of a batch run.
+
+    Accounts are the [spotify:NAME] sections of auth.ini, or one account per
+    token cache (.cache-USERNAME) in token_dir. Settings missing from a
+    section, and the app settings for token caches, come from [spotify].
+    """
+    base = dict(config["spotify"]) if config.has_section("spotify") else {}
+    if token_dir is not None:
+        return [
+            {
+                **base,
+                "name": os.path.basename(path)[len(".cache-") :],
+                "username": os.path.basename(path)[len(".cache-") :],
+                "cache_path": path,
+            }
+            for path in sorted(glob.glob(os.path.join(token_dir, ".cache-*")))
+        ]
+    return [
+        {**base, **config[section], "name": section.split(":", 1)[1]}
+        for section in config.sections()
+        if section.startswith("spotify:")
+    ]
+
+
+def _run_batch_account(args, account):
+    """Run the command for one account of a batch, in a worker process."""
+    name = account["name"]
+    formatter = logging.Formatter(f"%(asctime)s - {name} - %(levelname)s - %(message)s")
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(formatter)
+
+    args = argparse.Namespace(**vars(args))
+    if args.path is not None:
+        args.path = os.path.join(args.path, name)
+    # the accounts already keep the processes busy
+    args.processes = 1
+
+    api_stats = stats.ApiStats()
+    start = time.monotonic()
+    error = None
+    try:
+        cache_handler = spotipy.cache_handler.CacheFileHandler(
+            cache_path=account.get("cache_path"), username=account["username"]
+        )
+        if cache_handler.get_cached_token() is None:
+            # there is nobody to answer the login prompt in a worker
+            raise RuntimeError(
+                "no cached token, log in with a single account run first"
+            )
+        if run_account(args, account, api_stats):
+            error = "the export differs from the account"
+    except Exception as e:
+        logger.exception("failed")
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "account": name,
+        "path": args.path,
+        "error": error,
+        "wall_time": time.monotonic() - start,
+        "stats": api_stats.to_dict(),
+    }
+
+
+def run_batch(args, accounts):
+    """Run the command for many accounts on a pool of processes.
+
+    Every account gets its own rate budget and, for export and import, its
+    own subdirectory of path. Returns one result per account and prints a
+    summary.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as executor:
+        results = list(
+            executor.map(_run_batch_account, itertools.repeat(args), accounts)
+        )
+
+    row = "{:<24} {:<8} {:>9} {:>8} {:>8} {:>6}  {}"
+    print(row.format("account", "status", "wall s", "calls", "retries", "429", "path"))
+    for result in results:
+        endpoints = result["stats"]["endpoints"].values()
+        print(
+            row.format(
+                result["account"],
+                "ok" if result["error"] is None else "failed",
+                f"{result['wall_time']:.1f}",
+                sum(endpoint["calls"] for endpoint in endpoints),
+                sum(endpoint["retries"] for endpoint in endpoints),
+                sum(endpoint["rate_limited"] for endpoint in endpoints),
+                result["path"] or "",
+            )
+        )
+        if result["error"] is not None:
+            print(f"  {result['error']}")
+    return results
+
+
+def run_command(args, username, sp, api_stats, cache, uri_memo=None):
+    phase = api_stats.phase
+
+    with phase("authenticate"):
+        user_info = sp.me()
     logger.info("Authenticated as: %s (%s)", user_info["display_name"], user_info["id"])
 
     if args.command == "import":
-        if args.path is None:
-            parser.error("The 'import' command requires a path argument.")
-        import_playlist(sp, config["spotify"]["username"], args.path)
-        import_saved_tracks(sp, args.path)
-        import_albums(sp, args.path)
-        import_shows(sp, args.path)
+        dirname = args.path if os.path.isdir(args.path) else os.path.dirname(args.path)
+        with journal.open_journal(
+            os.path.join(dirname, constants.FILEPATH_JOURNAL),
+            "import",
+            resume=args.resume,
+        ) as jrnl:
+            validator = None
+            if args.validate:
+                validator = uri_validation.UriValidator(sp, uri_memo)
+            with phase("import playlists"):
+                import_playlist(
+                    sp,
+                    username,
+                    args.path,
+                    jobs=args.jobs,
+                    cache=cache,
+                    journal=jrnl,
+                    processes=args.processes,
+                    validator=validator,
+                )
+            with phase("import saved tracks"):
+                import_saved_tracks(
+                    sp,
+                    args.path,
+                    jobs=args.jobs,
+                    check_contains=args.check_contains,
+                    cache=cache,
+                    journal=jrnl,
+                    validator=validator,
+                )
+            with phase("import albums"):
+                import_albums(
+                    sp,
+                    args.path,
+                    jobs=args.jobs,
+                    check_contains=args.check_contains,
+                    cache=cache,
+                    journal=jrnl,
+                    validator=validator,
+                )
+            with phase("import shows"):
+                import_shows(
+                    sp,
+                    args.path,
+                    jobs=args.jobs,
+                    check_contains=args.check_contains,
+                    cache=cache,
+                    journal=jrnl,
+                    validator=validator,
+                )
+    elif args.command == "watch":
+        with phase("watch"):
+            run_watch(args, username, sp, api_stats)
+    elif args.command == "verify":
+        with phase("verify"):
+            return verify_export(
+                sp, username, args.path, jobs=args.jobs, full=args.full
+            )
+    elif args.command == "sync":
+        with phase("sync playlists"):
+            sync_playlist(sp, username, args.path, jobs=args.jobs, cache=cache)
+    elif args.command == "export" and args.format == "bundle":
+        with phase("export bundle"):
+            export_bundle(
+                sp,
+                username,
+                args.path,
+                jobs=args.jobs,
+                full=args.full,
+                cache=cache,
+            )
     elif args.command == "export":
-        if args.path is None:
-            parser.error("The 'export' command requires a path argument.")
-        export_playlists(sp, config["spotify"]["username"], args.path)
-        export_albums(sp, args.path)
-        export_shows(sp, args.path)
+        with journal.Journal(
+            os.path.join(args.path, constants.FILEPATH_JOURNAL),
+            "export",
+            resume=args.resume,
+        ) as jrnl:
+            with phase("export playlists"):
+                export_playlists(
+                    sp,
+                    username,
+                    args.path,
+                    jobs=args.jobs,
+                    full=args.full,
+                    cache=cache,
+                    journal=jrnl,
+                )
+            with phase("export albums"):
+                export_albums(
+                    sp,
+                    args.path,
+                    jobs=args.jobs,
+                    full=args.full,
+                    cache=cache,
+                    journal=jrnl,
+                )
+            with phase("export shows"):
+                export_shows(
+                    sp,
+                    args.path,
+                    jobs=args.jobs,
+                    full=args.full,
+                    cache=cache,
+                    journal=jrnl,
+                )
     elif args.command == "delete":
-        delete_all_user_playlists(sp)
-        delete_all_saved_tracks(sp)
-        delete_all_saved_albums(sp)
-        delete_all_saved_shows(sp)
+        with phase("delete playlists"):
+            delete_all_user_playlists(
+                sp, jobs=args.jobs, cache=cache, assume_yes=args.yes
+            )
+        with phase("delete saved tracks"):
+            delete_all_saved_tracks(
+                sp, jobs=args.jobs, cache=cache, assume_yes=args.yes
+            )
+        with phase("delete albums"):
+            delete_all_saved_albums(
+                sp, jobs=args.jobs, cache=cache, assume_yes=args.yes
+            )
+        with phase("delete shows"):
+            delete_all_saved_shows(sp, jobs=args.jobs, cache=cache, assume_yes=args.yes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import contextlib
+import json
+import sys
+import threading
+import time
+import urllib.parse
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket is open
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def endpoint_name(method, url):
+    """Group a request URL by endpoint, e.g. "GET playlists/{id}/tracks"."""
+    parts = urllib.parse.urlsplit(url).path.strip("/").split("/")
+    if parts and parts[0] == "v1":
+        parts = parts[1:]
+    if len(parts) > 1 and parts[0] != "me":
+        parts[1] = "{id}"
+    return f"{method} {'/'.join(parts)}"
+
+
+class _Endpoint:
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket that contains the given fraction of calls."""
+        wanted = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max_latency)
+        return self.max_latency
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "server_errors": self.server_errors,
+            "bytes": self.bytes,
+            "latency_total": self.latency,
+            "latency_max": self.max_latency,
+            "latency_histogram": dict(
+                zip([*map(str, LATENCY_BUCKETS), "inf"], self.histogram)
+            ),
+        }
+
+
+class ApiStats:
+    """Counters for every HTTP request to the Web API and timings of run phases.
+
+    Requests are recorded by a response hook on the requests session used by
+    spotipy, so retried requests and 429 responses are counted individually.
+    The scheduler reports the time spent waiting for the rate budget and on
+    backoff through ``record_wait()`` and the requests it repeats through
+    ``record_retry()``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._phases = []
+        self._waits = {}
+        self._local = threading.local()
+        self._started = time.perf_counter()
+
+    def instrument(self, session):
+        session.hooks["response"].append(self._on_response)
+        return session
+
+    def _on_response(self, response, **kwargs):
+        self.record_response(
+            response.request.method,
+            response.request.url,
+            response.status_code,
+            response.elapsed.total_seconds(),
+            len(response.content),
+        )
+
+    def record_response(self, method, url, status_code, latency, size):
+        """Count one HTTP response, for clients that don't use requests."""
+        name = endpoint_name(method, url)
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None:
+                endpoint = self._endpoints[name] = _Endpoint()
+            endpoint.calls += 1
+            if status_code == 429:
+                endpoint.rate_limited += 1
+            elif status_code >= 500:
+                endpoint.server_errors += 1
+            endpoint.bytes += size
+            endpoint.latency += latency
+            endpoint.max_latency = max(endpoint.max_latency, latency)
+            endpoint.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self._local.endpoint = endpoint
+
+    def record_retry(self):
+        """Count a retry of the request whose response this thread recorded last.
+
+        Called when the error is handled, before the thread sends another request.
+        """
+        endpoint = getattr(self._local, "endpoint", None)
+        if endpoint is not None:
+            with self._lock:
+                endpoint.retries += 1
+
+    def rate_limited(self):
+        """Number of 429 responses so far."""
+        with self._lock:
+            return sum(e.rate_limited for e in self._endpoints.values())
+
+    def record_wait(self, kind, seconds):
+        with self._lock:
+            self._waits[kind] = self._waits.get(kind, 0.0) + seconds
+
+    def _totals(self):
+        with self._lock:
+            return (
+                sum(e.calls for e in self._endpoints.values()),
+                sum(e.latency for e in self._endpoints.values()),
+                sum(self._waits.values()),
+            )
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a step of the run along with the requests made during it."""
+        calls, latency, waited = self._totals()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            end_calls, end_latency, end_waited = self._totals()
+            with self._lock:
+                self._phases.append(
+                    {
+                        "name": name,
+                        "wall_time": wall,
+                        "calls": end_calls - calls,
+                        "api_time": end_latency - latency,
+                        "waited": end_waited - waited,
+                    }
+                )
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "wall_time": time.perf_counter() - self._started,
+                "endpoints": {
+                    name: endpoint.to_dict()
+                    for name, endpoint in sorted(self._endpoints.items())
+                },
+                "phases": list(self._phases),
+                "waits": dict(self._waits),
+            }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+    def print_report(self, file=sys.stderr):
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            phases = list(self._phases)
+            waits = dict(self._waits)
+
+        row = "{:<40} {:>7} {:>7} {:>5} {:>9} {:>8} {:>8} {:>8}"
+        print(
+            row.format(
+                "endpoint",
+                "calls",
+                "retries",
+                "429",
+                "KiB",
+                "mean ms",
+                "p95 ms",
+                "max ms",
+            ),
+            file=file,
+        )
+        for name, e in endpoints:
+            print(
+                row.format(
+                    name,
+                    e.calls,
+                    e.retries,
+                    e.rate_limited,
+                    f"{e.bytes / 1024:.1f}",
+                    f"{e.latency / e.calls * 1000:.0f}",
+                    f"{e.percentile(0.95) * 1000:.0f}",
+                    f"{e.max_latency * 1000:.0f}",
+                ),
+                file=file,
+            )
+
+        if phases:
+            row = "{:<40} {:>9} {:>7} {:>9} {:>9}"
+            print(file=file)
+            print(
+                row.format("phase", "wall s", "calls", "api s", "waited s"), file=file
+            )
+            for p in phases:
+                print(
+                    row.format(
+                        p["name"],
+                        f"{p['wall_time']:.2f}",
+                        p["calls"],
+                        f"{p['api_time']:.2f}",
+                        f"{p['waited']:.2f}",
+                    ),
+                    file=file,
+                )
+
+        if waits:
+            print(file=file)
+            for kind, seconds in sorted(waits.items()):
+                print(f"waited for {kind}: {seconds:.2f} s", file=file)
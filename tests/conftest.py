@@ -0,0 +1,68 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fixtures that run spotify-playlists.py against fake_spotify.py."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import fake_spotify  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def spl():
+    return benchmark.load_script()
+
+
+@pytest.fixture
+def library():
+    return fake_spotify.Library(
+        playlists=0, saved_tracks=0, saved_albums=0, saved_shows=0
+    )
+
+
+@pytest.fixture
+def server(library):
+    server = fake_spotify.FakeSpotifyServer(library).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(spl, server):
+    """Return a client of the fake API for up to jobs workers."""
+    return lambda jobs=1: benchmark.make_client(spl, server.prefix, 1e6, jobs)
+
+
+def track_uri(n):
+    return fake_spotify.Library.track_uri(n)
+
+
+def write_playlist(spl, path, name, uris):
+    """Write a playlist file named name with the given tracks to path."""
+    dirname, filename = os.path.split(path)
+    spl.write_playlist(
+        name,
+        dirname,
+        (spl.records.make_track(f"Track {uri}", "Artist", uri) for uri in uris),
+        pl_type="playlist",
+    )
+    os.replace(os.path.join(dirname, f"{name}.xspf"), path)
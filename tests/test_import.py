@@ -0,0 +1,51 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from conftest import track_uri, write_playlist
+
+
+@pytest.mark.parametrize("jobs, processes", [(1, 1), (3, 1), (1, 2)])
+def test_files_with_the_same_name_and_cache(
+    spl, library, client, tmp_path, jobs, processes
+):
+    library.create_playlist("Mix", uris=[track_uri(1), track_uri(2)])
+    sp = client(jobs)
+    cache = spl.library_cache.LibraryCache(str(tmp_path / "cache.db"), "bench")
+    # caches the entries of "Mix" for its snapshot_id
+    spl.export_playlists(sp, "bench", str(tmp_path), cache=cache)
+
+    source = tmp_path / "import"
+    source.mkdir()
+    write_playlist(spl, str(source / "Mix 1.xspf"), "Mix", [track_uri(3), track_uri(4)])
+    write_playlist(spl, str(source / "Mix 2.xspf"), "Mix", [track_uri(3), track_uri(5)])
+    spl.import_playlist(
+        sp, "bench", str(source), jobs=jobs, cache=cache, processes=processes
+    )
+
+    assert library.playlists[0]["items"] == [track_uri(n) for n in range(1, 6)]
+
+
+def test_without_journal_where_it_cannot_be_written(spl, library, client, tmp_path):
+    write_playlist(spl, str(tmp_path / "Mix.xspf"), "Mix", [track_uri(1)])
+    path = tmp_path / spl.constants.FILEPATH_JOURNAL
+    # the journal can't create its temporary file, like in a read-only directory
+    (tmp_path / f"{path.name}.tmp").mkdir()
+    with spl.journal.open_journal(str(path), "import") as jrnl:
+        assert jrnl is None
+        spl.import_playlist(client(), "bench", str(tmp_path), journal=jrnl)
+
+    assert library.playlists[0]["items"] == [track_uri(1)]
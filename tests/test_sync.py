@@ -0,0 +1,61 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from conftest import track_uri, write_playlist
+
+LOCAL_URI = "spotify:local:Artist:Album:Title:180"
+
+
+def test_sync_matches_the_file(spl, library, client, tmp_path):
+    library.create_playlist("Mix", uris=[track_uri(n) for n in (1, 2, 3, 2)])
+    write_playlist(
+        spl, str(tmp_path / "Mix.xspf"), "Mix", [track_uri(n) for n in (3, 1, 4)]
+    )
+
+    spl.sync_playlist(client(), "bench", str(tmp_path))
+
+    assert library.playlists[0]["items"] == [track_uri(n) for n in (3, 1, 4)]
+
+
+def test_sync_keeps_local_files(spl, library, client, tmp_path):
+    library.create_playlist("Mix", uris=[track_uri(1), LOCAL_URI, track_uri(2)])
+    write_playlist(
+        spl, str(tmp_path / "Mix.xspf"), "Mix", [track_uri(n) for n in (2, 1, 3)]
+    )
+
+    spl.sync_playlist(client(), "bench", str(tmp_path))
+
+    # only new tracks are added, like on import
+    assert library.playlists[0]["items"] == [
+        track_uri(1),
+        LOCAL_URI,
+        track_uri(2),
+        track_uri(3),
+    ]
+
+
+def test_sync_files_with_the_same_name_and_cache(spl, library, client, tmp_path):
+    # long enough that moves and inserts need fewer requests than a rewrite
+    uris = [track_uri(n) for n in range(150)]
+    library.create_playlist("Mix", uris=uris)
+    sp = client()
+    cache = spl.library_cache.LibraryCache(str(tmp_path / "cache.db"), "bench")
+    spl.export_playlists(sp, "bench", str(tmp_path / "export"), cache=cache)
+    write_playlist(spl, str(tmp_path / "Mix 1.xspf"), "Mix", uris[1:] + uris[:1])
+    write_playlist(spl, str(tmp_path / "Mix 2.xspf"), "Mix", uris + [track_uri(200)])
+
+    spl.sync_playlist(sp, "bench", str(tmp_path), cache=cache)
+
+    assert library.playlists[0]["items"] == uris + [track_uri(200)]
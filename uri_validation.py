@@ -0,0 +1,136 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check URIs before they are added to playlists or saved.
+
+One malformed or unknown URI makes the whole chunk of an add request fail.
+URIs are checked locally for their syntax first, the rest in batches with the
+multi-get endpoints, which return null for ids that don't exist.
+"""
+
+import re
+import threading
+import time
+
+import library_cache
+
+URI_PATTERN = re.compile(r"spotify:(track|album|show|episode):[0-9A-Za-z]{22}")
+
+# ids per request of the multi-get endpoints
+BATCH_SIZES = {"track": 50, "album": 20, "show": 50, "episode": 50}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uris (
+    uri TEXT PRIMARY KEY,
+    valid INTEGER NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+def is_well_formed(uri):
+    return URI_PATTERN.fullmatch(uri) is not None
+
+
+class UriMemo:
+    """On-disk SQLite record of which URIs exist, valid for ``ttl`` seconds.
+
+    The catalog is the same for every account, so the file can be shared by
+    the accounts of a batch run and by later runs.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = library_cache.connect(path, SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, uris):
+        """Return {uri: valid} for the given URIs that were checked recently."""
+        uris = list(uris)
+        found = {}
+        with self._lock:
+            # stay below SQLite's limit of host parameters
+            for start in range(0, len(uris), 500):
+                chunk = uris[start : start + 500]
+                found.update(
+                    self._db.execute(
+                        f"SELECT uri, valid FROM uris WHERE checked_at > ? "
+                        f"AND uri IN ({', '.join('?' * len(chunk))})",
+                        (time.time() - self.ttl, *chunk),
+                    ).fetchall()
+                )
+        return {uri: bool(valid) for uri, valid in found.items()}
+
+    def put(self, results):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO uris (uri, valid, checked_at) VALUES (?, ?, ?)",
+                [(uri, int(valid), now) for uri, valid in results.items()],
+            )
+            self._db.commit()
+
+
+class UriValidator:
+    """Find the URIs that can be added, with as few requests as possible.
+
+    URIs are looked up in this run's results, then in ``memo`` (a UriMemo)
+    if given, and only the remaining ones are fetched from the API, up to
+    BATCH_SIZES ids per request. Safe to use from several threads.
+    """
+
+    def __init__(self, sp, memo=None):
+        self._sp = sp
+        self._memo = memo
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def valid(self, uris):
+        """Return the set of the given URIs that exist."""
+        uris = set(uris)
+        with self._lock:
+            results = {uri: self._known[uri] for uri in uris if uri in self._known}
+        unknown = [uri for uri in uris if uri not in results]
+
+        new = {uri: False for uri in unknown if not is_well_formed(uri)}
+        unknown = [uri for uri in unknown if uri not in new]
+        if self._memo is not None and unknown:
+            results.update(self._memo.get(unknown))
+            unknown = [uri for uri in unknown if uri not in results]
+
+        by_kind = {}
+        for uri in unknown:
+            by_kind.setdefault(uri.split(":")[1], []).append(uri)
+        for kind, kind_uris in by_kind.items():
+            fetch = getattr(self._sp, f"{kind}s")
+            size = BATCH_SIZES[kind]
+            for start in range(0, len(kind_uris), size):
+                chunk = kind_uris[start : start + size]
+                objects = fetch(chunk)[f"{kind}s"]
+                new.update((uri, obj is not None) for uri, obj in zip(chunk, objects))
+
+        # malformed URIs are cheap to find again, they aren't stored
+        checked = {uri: valid for uri, valid in new.items() if is_well_formed(uri)}
+        if self._memo is not None and checked:
+            self._memo.put(checked)
+        results.update(new)
+        with self._lock:
+            self._known.update(results)
+        return {uri for uri, valid in results.items() if valid}
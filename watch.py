@@ -0,0 +1,109 @@
+# Copyright (C) 2017 Felix Geyer <debfx@fobos.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 or (at your option)
+# version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Polling schedule and control socket of the watch command."""
+
+import json
+import logging
+import os
+import socketserver
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PollInterval:
+    """Seconds to wait between two polls of the library.
+
+    The interval is halved after a poll that found changes, since edits tend
+    to come in bursts, and grows by half after every quiet poll, within
+    ``minimum`` and ``maximum``. After a rate limited poll it is doubled. A
+    poll that made ``cost`` requests is never repeated sooner than
+    ``rate_share`` of the request budget (``rate`` per second) allows, even
+    if that exceeds ``maximum``.
+    """
+
+    def __init__(self, minimum, maximum, rate, rate_share):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.rate = rate
+        self.rate_share = rate_share
+        self.seconds = minimum
+
+    def update(self, changed, cost, rate_limited=False):
+        if rate_limited:
+            seconds = self.seconds * 2
+        elif changed:
+            seconds = self.seconds / 2
+        else:
+            seconds = self.seconds * 1.5
+        seconds = min(self.maximum, max(self.minimum, seconds))
+        self.seconds = max(seconds, cost / (self.rate * self.rate_share))
+        return self.seconds
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode("utf-8", "replace").strip()
+            if command == "sync":
+                self.server.wake.set()
+                reply = "ok"
+            elif command == "stop":
+                self.server.stop.set()
+                self.server.wake.set()
+                reply = "ok"
+            elif command == "status":
+                reply = json.dumps(self.server.status())
+            else:
+                reply = f"unknown command: {command}"
+            self.wfile.write(f"{reply}\n".encode("utf-8"))
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class ControlServer(socketserver.ThreadingUnixStreamServer):
+        """Local control socket of a running watch, served on a daemon thread.
+
+        Clients send one command per line: ``sync`` polls right away, ``stop``
+        ends the watch after the current cycle and ``status`` answers with the
+        JSON object returned by ``status()``. Every command gets a one line reply.
+        """
+
+        daemon_threads = True
+
+        def __init__(self, path, wake, stop, status):
+            if os.path.exists(path):
+                # left behind by a watch that didn't shut down cleanly
+                os.remove(path)
+            super().__init__(path, _ControlHandler)
+            self.path = path
+            self.wake = wake
+            self.stop = stop
+            self.status = status
+
+        def start(self):
+            threading.Thread(target=self.serve_forever, daemon=True).start()
+            logger.info("listening for commands on %s", self.path)
+            return self
+
+        def close(self):
+            self.shutdown()
+            self.server_close()
+            os.remove(self.path)
+
+else:
+    # no Unix domain sockets on this platform, watch runs without --control-socket
+    ControlServer = None